@@ -6,25 +6,49 @@
 
 # --- 1. استيراد المكتبات الأساسية ---
 import os
+import re
+import io
+import csv
+import sys
+import subprocess
+import time
+import hashlib
+import threading
+try:
+    import fcntl
+except ImportError:  # Windows: لا يوجد قفل ملفات، فكل عملية تعتبر نفسها القائدة
+    fcntl = None
+import zipfile
+import mimetypes
+import json
+import sqlite3
+import zlib
+import gzip
+import lzma
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
 import shutil
-import requests
-from datetime import datetime
+import tempfile
+import click
+from datetime import datetime, date, timedelta
 from urllib.parse import quote
-from pathlib import Path
 from flask import (
     Flask, request, redirect, url_for, flash, render_template, 
-    make_response, send_from_directory
+    make_response, send_from_directory, jsonify, Response, stream_with_context, g
 )
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import (
     LoginManager, UserMixin, login_user, logout_user, 
     login_required, current_user
 )
+from flask_jwt_extended import JWTManager, create_access_token, jwt_required
+from flask_cors import CORS
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
-from jinja2 import DictLoader
-from sqlalchemy import func, or_
-from weasyprint import HTML
+from jinja2 import DictLoader, FileSystemBytecodeCache
+from sqlalchemy import func, and_, or_, tuple_, update, text, case, select, insert, delete, event, literal_column, literal, false, inspect
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import validates, selectinload
 from flask_apscheduler import APScheduler
 
 # --- 2. تعريف قوالب HTML ---
@@ -41,242 +65,7 @@ templates = {
     <link rel="preconnect" href="https://fonts.googleapis.com">
     <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
     <link href="https://fonts.googleapis/css2?family=Cairo:wght@400;700&display=swap" rel="stylesheet">
-    <style>
-        :root {
-            --primary-color: #d63384;
-            --primary-hover: #b02a6c;
-            --secondary-color: #6c757d;
-            --success-color: #198754;
-            --danger-color: #dc3545;
-            --warning-color: #ffc107;
-            --info-color: #0dcaf0;
-            --light-color: #f8f9fa;
-            --dark-color: #212529;
-        }
-        
-        body { 
-            font-family: 'Cairo', sans-serif; 
-            background-color: #f8f9fa; 
-            min-height: 100vh;
-            display: flex;
-            flex-direction: column;
-        }
-        
-        .navbar { 
-            background-color: #ffffff; 
-            box-shadow: 0 2px 4px rgba(0,0,0,.1); 
-        }
-        
-        .nav-link.active { 
-            font-weight: bold; 
-            color: var(--primary-color) !important; 
-        }
-        
-        .btn-primary { 
-            background-color: var(--primary-color); 
-            border-color: var(--primary-color); 
-        }
-        
-        .btn-primary:hover { 
-            background-color: var(--primary-hover); 
-            border-color: var(--primary-hover); 
-        }
-        
-        .table-hover tbody tr:hover { 
-            background-color: #f8f9fa; 
-            transition: background-color 0.2s ease;
-        }
-        
-        .spinner-overlay { 
-            position: fixed; 
-            top: 0; 
-            left: 0; 
-            width: 100%; 
-            height: 100%; 
-            background-color: rgba(0,0,0,0.5); 
-            z-index: 1060; 
-            display: none; 
-            justify-content: center; 
-            align-items: center; 
-        }
-        
-        .status-badge { 
-            font-size: 0.9em; 
-            white-space: nowrap;
-        }
-        
-        .status-جديد { 
-            background-color: var(--warning-color) !important; 
-            color: black; 
-        }
-        
-        .status-تم-الشراء { 
-            background-color: var(--info-color) !important; 
-            color: white; 
-        }
-        
-        .status-في-الطريق { 
-            background-color: #fd7e14 !important; 
-            color: white; 
-        }
-        
-        .status-تم-التسليم { 
-            background-color: var(--success-color) !important; 
-            color: white; 
-        }
-        
-        .payment-لم-يتم-الدفع { 
-            background-color: var(--danger-color) !important; 
-            color: white; 
-        }
-        
-        .payment-تم-الدفع { 
-            background-color: var(--success-color) !important; 
-            color: white; 
-        }
-        
-        /* تحسينات عامة للواجهة */
-        .card {
-            border-radius: 12px;
-            border: none;
-            box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
-            transition: all 0.3s ease;
-        }
-        
-        .card:hover {
-            box-shadow: 0 8px 15px rgba(0, 0, 0, 0.15);
-        }
-        
-        .btn {
-            border-radius: 8px;
-            font-weight: 600;
-            padding: 0.5rem 1.5rem;
-            transition: all 0.2s ease;
-        }
-        
-        .btn:hover {
-            transform: translateY(-1px);
-        }
-        
-        .table {
-            border-radius: 8px;
-            overflow: hidden;
-        }
-        
-        .table th {
-            background-color: #d63384;
-            color: white;
-            font-weight: 600;
-            padding: 12px 15px;
-        }
-        
-        .table td {
-            padding: 12px 15px;
-            vertical-align: middle;
-        }
-        
-        .form-control, .form-select {
-            border-radius: 8px;
-            padding: 12px 15px;
-            border: 1px solid #ddd;
-            transition: all 0.3s ease;
-        }
-        
-        .form-control:focus, .form-select:focus {
-            border-color: #d63384;
-            box-shadow: 0 0 0 0.2rem rgba(214, 51, 132, 0.25);
-        }
-        
-        .alert {
-            border-radius: 8px;
-            border: none;
-            padding: 15px 20px;
-        }
-        
-        .dropdown-menu {
-            border-radius: 8px;
-            box-shadow: 0 5px 15px rgba(0, 0, 0, 0.1);
-            border: none;
-        }
-        
-        .dropdown-item {
-            padding: 10px 15px;
-            transition: all 0.2s ease;
-        }
-        
-        .dropdown-item:hover {
-            background-color: #f8f9fa;
-        }
-        
-        .currency {
-            font-family: 'Cairo', sans-serif;
-            direction: ltr;
-            display: inline-block;
-            font-weight: 600;
-        }
-        
-        /* تحسينات للهواتف */
-        @media (max-width: 768px) {
-            .container {
-                padding-left: 15px;
-                padding-right: 15px;
-            }
-            
-            .table-responsive {
-                overflow-x: auto;
-                -webkit-overflow-scrolling: touch;
-                border-radius: 8px;
-            }
-            
-            .navbar-brand {
-                font-size: 1.1rem;
-            }
-            
-            .btn {
-                padding: 0.375rem 0.75rem;
-                font-size: 0.875rem;
-                width: 100%;
-                margin-bottom: 10px;
-            }
-            
-            .card {
-                margin-bottom: 1rem;
-            }
-            
-            .dropdown-menu {
-                position: static !important;
-                transform: none !important;
-            }
-        }
-        
-        /* تحسينات للتطبع والطباعة */
-        @media print {
-            .navbar, .btn, .dropdown, .spinner-overlay {
-                display: none !important;
-            }
-            
-            body {
-                background-color: white;
-                font-size: 12pt;
-            }
-            
-            .container {
-                width: 100%;
-                max-width: 100%;
-            }
-        }
-        
-        main {
-            flex: 1;
-        }
-        
-        footer {
-            background-color: var(--dark-color);
-            color: white;
-            padding: 1rem 0;
-            margin-top: auto;
-        }
-    </style>
+    <link rel="stylesheet" href="{{ url_for('layout_css', v=layout_css_version) }}">
 </head>
 <body>
     <nav class="navbar navbar-expand-lg navbar-light mb-4">
@@ -367,7 +156,24 @@ templates = {
 {% block content %}
 <div class="d-flex justify-content-between align-items-center mb-4 flex-wrap">
     <h2>إدارة الطلبات</h2>
-    <a href="{{ url_for('add_order') }}" class="btn btn-primary mt-2 mt-md-0"><i class="bi bi-plus-circle-fill me-2"></i>إضافة طلب جديد</a>
+    <div class="d-flex gap-2 flex-wrap">
+        <div class="dropdown mt-2 mt-md-0">
+            <button class="btn btn-outline-secondary dropdown-toggle" type="button" data-bs-toggle="dropdown"><i class="bi bi-files me-2"></i>تصدير الفواتير</button>
+            <ul class="dropdown-menu">
+                <li><a class="dropdown-item" href="{{ url_for('bulk_invoice_export', format='zip', **filters) }}"><i class="bi bi-file-zip me-2"></i>ملف ZIP (فاتورة لكل طلب)</a></li>
+                <li><a class="dropdown-item" href="{{ url_for('bulk_invoice_export', format='pdf', **filters) }}" onclick="showSpinner()"><i class="bi bi-file-earmark-pdf me-2"></i>ملف PDF واحد</a></li>
+            </ul>
+        </div>
+        <div class="dropdown mt-2 mt-md-0">
+            <button class="btn btn-outline-secondary dropdown-toggle" type="button" data-bs-toggle="dropdown"><i class="bi bi-download me-2"></i>تصدير الطلبات</button>
+            <ul class="dropdown-menu">
+                <li><a class="dropdown-item" href="{{ url_for('export_orders', format='csv', **filters) }}"><i class="bi bi-filetype-csv me-2"></i>CSV (سطر لكل منتج)</a></li>
+                <li><a class="dropdown-item" href="{{ url_for('export_orders', format='jsonl', **filters) }}"><i class="bi bi-filetype-json me-2"></i>JSON Lines (سطر لكل طلب)</a></li>
+            </ul>
+        </div>
+        <a href="{{ url_for('import_orders') }}" class="btn btn-outline-primary mt-2 mt-md-0"><i class="bi bi-filetype-csv me-2"></i>استيراد من CSV</a>
+        <a href="{{ url_for('add_order') }}" class="btn btn-primary mt-2 mt-md-0"><i class="bi bi-plus-circle-fill me-2"></i>إضافة طلب جديد</a>
+    </div>
 </div>
 <div class="card mb-4">
     <div class="card-body">
@@ -375,7 +181,7 @@ templates = {
             <div class="col-12 col-md-4">
                 <div class="input-group">
                     <span class="input-group-text"><i class="bi bi-search"></i></span>
-                    <input type="text" class="form-control" name="search_term" placeholder="ابحث بالاسم، الهاتف، أو رقم الطلب..." value="{{ request.args.get('search_term', '') }}">
+                    <input type="text" class="form-control" name="search_term" placeholder="ابحث بالاسم، الهاتف، المدينة، المنتج أو رقم الطلب..." value="{{ request.args.get('search_term', '') }}">
                 </div>
             </div>
             <div class="col-6 col-md-2">
@@ -400,15 +206,59 @@ templates = {
             <div class="col-12 col-md-2">
                 <a href="{{ url_for('dashboard') }}" class="btn btn-outline-secondary w-100">إعادة تعيين</a>
             </div>
+            <div class="col-12 col-md-4">
+                <input type="text" class="form-control" name="destination_city" placeholder="المدينة" value="{{ request.args.get('destination_city', '') }}">
+            </div>
+            <div class="col-6 col-md-2">
+                <input type="date" class="form-control" name="date_from" title="من تاريخ" value="{{ request.args.get('date_from', '') }}">
+            </div>
+            <div class="col-6 col-md-2">
+                <input type="date" class="form-control" name="date_to" title="إلى تاريخ" value="{{ request.args.get('date_to', '') }}">
+            </div>
         </form>
     </div>
 </div>
 <div class="card">
     <div class="card-body">
+        <form id="bulk-status-form" method="POST" action="{{ url_for('bulk_update_status') }}" class="row g-2 align-items-center mb-3">
+            {% for key, value in filters.items() %}<input type="hidden" name="{{ key }}" value="{{ value }}">{% endfor %}
+            <div class="col-auto fw-bold">تغيير الحالة:</div>
+            <div class="col-auto">
+                <select name="new_order_status" class="form-select form-select-sm">
+                    <option value="">حالة الطلب بدون تغيير</option>
+                    {% for status in statuses %}<option value="{{ status }}">{{ status }}</option>{% endfor %}
+                </select>
+            </div>
+            <div class="col-auto">
+                <select name="new_payment_status" class="form-select form-select-sm">
+                    <option value="">حالة الدفع بدون تغيير</option>
+                    <option value="لم يتم الدفع">لم يتم الدفع</option>
+                    <option value="تم الدفع">تم الدفع</option>
+                </select>
+            </div>
+            <div class="col-auto">
+                <div class="form-check">
+                    <input class="form-check-input" type="checkbox" name="apply_to_filter" value="1" id="apply_to_filter">
+                    <label class="form-check-label" for="apply_to_filter">كل الطلبات المطابقة للفلترة</label>
+                </div>
+            </div>
+            {% if not filters %}
+            <div class="col-auto">
+                <div class="form-check">
+                    <input class="form-check-input" type="checkbox" name="confirm_all" value="1" id="confirm_all">
+                    <label class="form-check-label text-danger" for="confirm_all">لا توجد فلترة: تأكيد التطبيق على كل الطلبات</label>
+                </div>
+            </div>
+            {% endif %}
+            <div class="col-auto">
+                <button type="submit" class="btn btn-sm btn-warning" onclick="return confirm('تغيير حالة الطلبات المحددة؟')">تطبيق</button>
+            </div>
+        </form>
         <div class="table-responsive">
             <table class="table table-hover align-middle">
                 <thead class="table-light">
                     <tr>
+                        <th><input type="checkbox" class="form-check-input" title="تحديد الكل" onclick="document.querySelectorAll('.order-select').forEach(cb => cb.checked = this.checked)"></th>
                         <th>#</th><th>العميل</th><th>المدينة</th><th>الإجمالي</th>
                         <th>حالة الطلب</th><th>حالة الدفع</th><th>التاريخ</th><th>إجراءات</th>
                     </tr>
@@ -416,6 +266,7 @@ templates = {
                 <tbody>
                     {% for order in orders %}
                     <tr>
+                        <td><input type="checkbox" class="form-check-input order-select" name="order_ids" value="{{ order.id }}" form="bulk-status-form"></td>
                         <td>{{ order.id }}</td>
                         <td>{{ order.customer_name }}<br><small class="text-muted">{{ order.customer_phone }}</small></td>
                         <td>{{ order.destination_city }}</td>
@@ -435,11 +286,30 @@ templates = {
                         </td>
                     </tr>
                     {% else %}
-                    <tr><td colspan="8" class="text-center">لا توجد طلبات تطابق معايير البحث.</td></tr>
+                    <tr><td colspan="9" class="text-center">لا توجد طلبات تطابق معايير البحث.</td></tr>
                     {% endfor %}
                 </tbody>
             </table>
         </div>
+        <div class="d-flex justify-content-between align-items-center flex-wrap mt-3">
+            <div class="text-muted">
+                {% if total_orders is not none %}
+                إجمالي النتائج: {{ total_orders }}
+                {% else %}
+                <a href="{{ url_for('dashboard', show_total='1', **page_args) }}">عرض العدد الكلي</a>
+                {% endif %}
+            </div>
+            <nav>
+                <ul class="pagination mb-0">
+                    <li class="page-item {% if not prev_cursor %}disabled{% endif %}">
+                        <a class="page-link" href="{{ url_for('dashboard', before=prev_cursor, **page_args) if prev_cursor else '#' }}">السابق</a>
+                    </li>
+                    <li class="page-item {% if not next_cursor %}disabled{% endif %}">
+                        <a class="page-link" href="{{ url_for('dashboard', after=next_cursor, **page_args) if next_cursor else '#' }}">التالي</a>
+                    </li>
+                </ul>
+            </nav>
+        </div>
     </div>
 </div>
 {% endblock %}
@@ -481,6 +351,7 @@ function previewInvoice(orderId) {
                 {% if order and order.products %}
                 {% for product in order.products %}
                 <div class="row product-row mb-3 align-items-center">
+                    <input type="hidden" name="product_id" value="{{ product.id }}">
                     <div class="col-12 col-md-4 mb-2 mb-md-0">
                         <input type="text" name="product_name" class="form-control" placeholder="اسم المنتج" value="{{ product.description }}" required>
                     </div>
@@ -553,6 +424,7 @@ document.addEventListener('DOMContentLoaded', function() {
         const productRow = document.createElement('div');
         productRow.className = 'row product-row mb-3 align-items-center';
         productRow.innerHTML = `
+            <input type="hidden" name="product_id" value="">
             <div class="col-12 col-md-4 mb-2 mb-md-0">
                 <input type="text" name="product_name" class="form-control" placeholder="اسم المنتج" value="${name}" required>
             </div>
@@ -654,6 +526,16 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 </style>
 <h2 class="mb-4">نظرة عامة على الأداء</h2>
+<div class="card mb-4">
+    <div class="card-body">
+        <form method="GET" action="{{ url_for('statistics') }}" class="row g-2 align-items-center">
+            <div class="col-6 col-md-4"><label for="date_from" class="form-label">من تاريخ</label><input type="date" class="form-control" id="date_from" name="date_from" value="{{ date_from }}"></div>
+            <div class="col-6 col-md-4"><label for="date_to" class="form-label">إلى تاريخ</label><input type="date" class="form-control" id="date_to" name="date_to" value="{{ date_to }}"></div>
+            <div class="col-6 col-md-2 align-self-end"><button type="submit" class="btn btn-info w-100">تطبيق</button></div>
+            <div class="col-6 col-md-2 align-self-end"><a href="{{ url_for('statistics') }}" class="btn btn-outline-secondary w-100">إعادة تعيين</a></div>
+        </form>
+    </div>
+</div>
 <div class="row">
     <div class="col-md-6 col-lg-3"><div class="stat-card bg-revenue"><h3>{{ "{:,.0f}".format(stats.total_revenue) }}</h3><p>إجمالي الإيرادات (ج.س)</p></div></div>
     <div class="col-md-6 col-lg-3"><div class="stat-card bg-orders"><h3>{{ stats.total_orders }}</h3><p>إجمالي الطلبات</p></div></div>
@@ -664,6 +546,63 @@ document.addEventListener('DOMContentLoaded', function() {
     <div class="col-md-12"><div class="card"><div class="card-header"><h4>أكثر المدن طلباً</h4></div><div class="card-body">{% if stats.top_cities %}<ul class="list-group">{% for city, count in stats.top_cities %}<li class="list-group-item d-flex justify-content-between align-items-center">{{ city }}<span class="badge bg-primary rounded-pill">{{ count }} طلبات</span></li>{% endfor %}</ul>{% else %}<p class="text-muted">لا توجد بيانات كافية لعرضها.</p>{% endif %}</div></div></div>
 </div>
 {% endblock %}
+""",
+    "import_orders.html": """
+{% extends "layout.html" %}
+{% block title %}استيراد الطلبات{% endblock %}
+{% block content %}
+<h2>استيراد الطلبات من ملف CSV</h2>
+<div class="row mt-4">
+    <div class="col-md-5">
+        <div class="card">
+            <div class="card-header"><h4><i class="bi bi-upload me-2"></i>رفع الملف</h4></div>
+            <div class="card-body">
+                <p>سطر لكل منتج، والأسطر التي تحمل نفس <code>order_key</code> تُجمع في طلب واحد (يجب أن تكون متتالية). بيانات الطلب تؤخذ من أول سطر فيه.</p>
+                <p class="small text-muted mb-1">الأعمدة المطلوبة:</p>
+                <p class="small"><code>{{ required_columns | join(', ') }}</code></p>
+                <p class="small text-muted mb-1">أعمدة اختيارية:</p>
+                <p class="small"><code>{{ optional_columns | join(', ') }}</code></p>
+                <form action="{{ url_for('import_orders') }}" method="post" enctype="multipart/form-data">
+                    <div class="mb-3">
+                        <input class="form-control" type="file" name="orders_file" accept=".csv" required>
+                    </div>
+                    <button type="submit" class="btn btn-primary w-100" onclick="showSpinner()">استيراد</button>
+                </form>
+            </div>
+        </div>
+    </div>
+    {% if result %}
+    <div class="col-md-7">
+        <div class="card">
+            <div class="card-header"><h4><i class="bi bi-clipboard-data me-2"></i>نتيجة الاستيراد</h4></div>
+            <div class="card-body">
+                <ul class="list-group mb-3">
+                    <li class="list-group-item d-flex justify-content-between">الأسطر المقروءة<span class="badge bg-secondary rounded-pill">{{ "{:,}".format(result.rows) }}</span></li>
+                    <li class="list-group-item d-flex justify-content-between">الطلبات المضافة<span class="badge bg-success rounded-pill">{{ "{:,}".format(result.orders) }}</span></li>
+                    <li class="list-group-item d-flex justify-content-between">المنتجات المضافة<span class="badge bg-success rounded-pill">{{ "{:,}".format(result.products) }}</span></li>
+                    <li class="list-group-item d-flex justify-content-between">الطلبات المرفوضة<span class="badge bg-danger rounded-pill">{{ "{:,}".format(result.failed_orders) }}</span></li>
+                </ul>
+                {% if result.errors %}
+                <div class="table-responsive">
+                    <table class="table table-sm">
+                        <thead><tr><th>السطر</th><th>order_key</th><th>الخطأ</th></tr></thead>
+                        <tbody>
+                            {% for error in result.errors %}
+                            <tr><td>{{ error.line }}</td><td>{{ error.order_key }}</td><td>{{ error.message }}</td></tr>
+                            {% endfor %}
+                        </tbody>
+                    </table>
+                </div>
+                {% if result.error_count > result.errors | length %}
+                <p class="text-muted mb-0">تم عرض أول {{ result.errors | length }} خطأ من أصل {{ "{:,}".format(result.error_count) }}.</p>
+                {% endif %}
+                {% endif %}
+            </div>
+        </div>
+    </div>
+    {% endif %}
+</div>
+{% endblock %}
 """,
     "system_management.html": """
 {% extends "layout.html" %}
@@ -682,11 +621,16 @@ document.addEventListener('DOMContentLoaded', function() {
                 {% if backups %}
                 <div class="table-responsive">
                     <table class="table table-hover">
-                        <thead><tr><th>اسم الملف</th><th class="text-center">الإجراءات</th></tr></thead>
+                        <thead><tr><th>اسم الملف</th><th>الحجم الفعلي</th><th>المساحة المستخدمة</th><th>الصفحات</th><th>المدة</th><th class="text-center">الإجراءات</th></tr></thead>
                         <tbody>
-                            {% for backup in backups %}
+                            {% for record in backups %}
+                            {% set backup = record.name %}
                             <tr>
                                 <td class="align-middle">{{ backup }}</td>
+                                <td class="align-middle">{{ "{:,.2f}".format(record.size_bytes / 1048576) }} MB</td>
+                                <td class="align-middle">{{ "{:,.2f}".format(record.physical_bytes / 1048576) }} MB</td>
+                                <td class="align-middle">{{ "{:,}".format(record.page_count) if record.page_count else '-' }}</td>
+                                <td class="align-middle">{{ "{:,.0f}".format(record.duration_ms) ~ ' ms' if record.duration_ms else '-' }}</td>
                                 <td class="text-center">
                                     <a href="{{ url_for('download_backup', filename=backup) }}" class="btn btn-sm btn-success"><i class="bi bi-download me-1"></i> تحميل</a>
                                     <form method="POST" action="{{ url_for('restore_backup') }}" style="display: inline-block;" onsubmit="return confirm('تحذير! هذه العملية ستحذف جميع البيانات الحالية وتستبدلها بالبيانات من النسخة الاحتياطية {{ backup }}. هل أنت متأكد؟');">
@@ -699,6 +643,7 @@ document.addEventListener('DOMContentLoaded', function() {
                         </tbody>
                     </table>
                 </div>
+                <p class="text-muted mb-0">إجمالي حجم النسخ: {{ "{:,.2f}".format(logical_total / 1048576) }} MB، المساحة المستخدمة فعلياً على القرص: {{ "{:,.2f}".format(physical_total / 1048576) }} MB</p>
                 {% else %}
                 <p class="text-muted">لا توجد نسخ احتياطية متاحة.</p>
                 {% endif %}
@@ -718,6 +663,16 @@ document.addEventListener('DOMContentLoaded', function() {
                 </form>
             </div>
         </div>
+        <div class="card mt-4">
+            <div class="card-header"><h4><i class="bi bi-file-earmark-pdf me-2"></i>ذاكرة الفواتير المؤقتة</h4></div>
+            <div class="card-body">
+                <ul class="list-group">
+                    <li class="list-group-item d-flex justify-content-between">مرات الاستخدام من الذاكرة<span class="badge bg-success rounded-pill">{{ invoice_cache.hits }}</span></li>
+                    <li class="list-group-item d-flex justify-content-between">مرات إنشاء الفاتورة<span class="badge bg-secondary rounded-pill">{{ invoice_cache.misses }}</span></li>
+                    <li class="list-group-item d-flex justify-content-between">الملفات المحذوفة لتوفير المساحة<span class="badge bg-warning rounded-pill">{{ invoice_cache.evictions }}</span></li>
+                </ul>
+            </div>
+        </div>
     </div>
 </div>
 {% endblock %}
@@ -728,227 +683,7 @@ document.addEventListener('DOMContentLoaded', function() {
 <head>
     <meta charset="UTF-8">
     <title>فاتورة طلب #{{ order.id }}</title>
-    <style>
-        /* تضمين خطوط عربية من Google Fonts */
-        @import url('https://fonts.googleapis.com/css2?family=Cairo:wght@300;400;600;700&display=swap');
-        
-        body { 
-            font-family: 'Cairo', sans-serif;
-            margin: 0;
-            padding: 0;
-            color: #333;
-            line-height: 1.6;
-            background-color: #fff;
-        }
-        
-        .invoice-container {
-            width: 100%;
-            max-width: 800px;
-            margin: 0 auto;
-            padding: 25px;
-            box-sizing: border-box;
-            background-color: #fff;
-            border-radius: 12px;
-            box-shadow: 0 5px 15px rgba(0, 0, 0, 0.1);
-            overflow: hidden;
-        }
-        
-        .header {
-            display: flex;
-            justify-content: space-between;
-            align-items: flex-start;
-            margin-bottom: 30px;
-            padding-bottom: 20px;
-            border-bottom: 2px solid #d63384;
-        }
-        
-        .logo-container {
-            flex: 1;
-        }
-        
-        .logo {
-            max-width: 120px;
-            height: auto;
-        }
-        
-        .invoice-info {
-            flex: 1;
-            text-align: left;
-            direction: ltr;
-        }
-        
-        .invoice-info h1 {
-            color: #d63384;
-            margin: 0 0 10px 0;
-            font-size: 28px;
-            font-weight: 700;
-        }
-        
-        .invoice-info p {
-            margin: 5px 0;
-            font-size: 16px;
-        }
-        
-        .customer-details {
-            display: flex;
-            justify-content: space-between;
-            margin-bottom: 30px;
-            gap: 20px;
-        }
-        
-        .bill-to, .payment-info {
-            flex: 1;
-            background-color: #f8f9fa;
-            padding: 20px;
-            border-radius: 10px;
-            border: 1px solid #e9ecef;
-        }
-        
-        .bill-to h3, .payment-info h3 {
-            color: #d63384;
-            margin-top: 0;
-            margin-bottom: 15px;
-            padding-bottom: 8px;
-            border-bottom: 1px solid #ddd;
-            font-size: 18px;
-            font-weight: 600;
-        }
-        
-        .bill-to p, .payment-info p {
-            margin: 8px 0;
-        }
-        
-        .items-table {
-            width: 100%;
-            border-collapse: collapse;
-            margin: 25px 0;
-            border-radius: 10px;
-            overflow: hidden;
-            box-shadow: 0 2px 5px rgba(0, 0, 0, 0.05);
-        }
-        
-        .items-table th {
-            background-color: #d63384;
-            color: white;
-            padding: 15px;
-            text-align: center;
-            font-weight: 600;
-        }
-        
-        .items-table td {
-            padding: 15px;
-            border-bottom: 1px solid #ddd;
-            text-align: center;
-        }
-        
-        .items-table tr:nth-child(even) {
-            background-color: #f9f9f9;
-        }
-        
-        .text-left {
-            text-align: left;
-        }
-        
-        .text-center {
-            text-align: center;
-        }
-        
-        .text-right {
-            text-align: right;
-        }
-        
-        .totals {
-            width: 100%;
-            margin-top: 25px;
-        }
-        
-        .totals table {
-            width: 50%;
-            margin-left: 50%;
-            border-collapse: collapse;
-            background-color: #f8f9fa;
-            border-radius: 10px;
-            padding: 15px;
-        }
-        
-        .totals td {
-            padding: 12px 15px;
-            border-bottom: 1px solid #eee;
-        }
-        
-        .totals tr:last-child td {
-            border-bottom: none;
-            font-weight: 700;
-            font-size: 18px;
-            color: #d63384;
-        }
-        
-        .footer {
-            text-align: center;
-            margin-top: 40px;
-            padding-top: 20px;
-            border-top: 1px solid #ddd;
-            color: #777;
-            font-size: 14px;
-            background-color: #f8f9fa;
-            padding: 20px;
-            border-radius: 10px;
-            margin-top: 30px;
-        }
-        
-        .thank-you {
-            font-size: 16px;
-            color: #d63384;
-            margin-bottom: 10px;
-            font-weight: 600;
-        }
-        
-        .decoration {
-            text-align: center;
-            margin: 20px 0;
-            color: #d63384;
-            font-size: 24px;
-        }
-        
-        .currency {
-            font-family: 'Cairo', sans-serif;
-            direction: ltr;
-            display: inline-block;
-        }
-        
-        /* تحسينات للطباعة */
-        @media print {
-            body {
-                font-size: 12pt;
-            }
-            
-            .invoice-container {
-                padding: 0;
-                max-width: 100%;
-                box-shadow: none;
-            }
-            
-            .header {
-                margin-bottom: 20px;
-            }
-            
-            .customer-details {
-                margin-bottom: 20px;
-            }
-            
-            .items-table {
-                margin: 15px 0;
-            }
-            
-            .items-table th, .items-table td {
-                padding: 10px 12px;
-            }
-            
-            .footer {
-                margin-top: 20px;
-            }
-        }
-    </style>
+    {% if embed_styles %}<style>{{ invoice_css|safe }}</style>{% endif %}
 </head>
 <body>
     <div class="invoice-container">
@@ -1029,72 +764,1125 @@ document.addEventListener('DOMContentLoaded', function() {
 """
 }
 
-# --- 3. إعدادات التطبيق الرئيسية ---
-basedir = os.path.abspath(os.path.dirname(__file__))
-DB_NAME = 'app_v7.db'
-DB_PATH = os.path.join(basedir, 'instance', DB_NAME)
-BACKUP_DIR = os.path.join(basedir, 'backups')
-STATIC_DIR = os.path.join(basedir, 'static')
+# --- 2.1 أنماط الفاتورة (Invoice Stylesheet) ---
+# تُترجم مرة واحدة إلى كائن CSS في WeasyPrint بدلاً من تحليلها مع كل فاتورة، وتُضمَّن في صفحة المعاينة فقط
+INVOICE_CSS = """
+body { 
+    font-family: 'Cairo', sans-serif;
+    margin: 0;
+    padding: 0;
+    color: #333;
+    line-height: 1.6;
+    background-color: #fff;
+}
 
-app = Flask(__name__, static_folder=STATIC_DIR)
-app.jinja_loader = DictLoader(templates)
-app.config['SECRET_KEY'] = 'a-very-secret-key-for-v7.0'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + DB_PATH
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SCHEDULER_API_ENABLED'] = True
+.invoice-container {
+    width: 100%;
+    max-width: 800px;
+    margin: 0 auto;
+    padding: 25px;
+    box-sizing: border-box;
+    background-color: #fff;
+    border-radius: 12px;
+    box-shadow: 0 5px 15px rgba(0, 0, 0, 0.1);
+    overflow: hidden;
+}
 
-os.makedirs(os.path.join(basedir, 'instance'), exist_ok=True)
-os.makedirs(BACKUP_DIR, exist_ok=True)
-os.makedirs(STATIC_DIR, exist_ok=True)
+.header {
+    display: flex;
+    justify-content: space-between;
+    align-items: flex-start;
+    margin-bottom: 30px;
+    padding-bottom: 20px;
+    border-bottom: 2px solid #d63384;
+}
 
-# --- 4. تهيئة الإضافات (Extensions) ---
-db = SQLAlchemy(app)
-scheduler = APScheduler()
-scheduler.init_app(app)
-scheduler.start()
-login_manager = LoginManager(app)
-login_manager.login_view = 'login'
-login_manager.login_message = "الرجاء تسجيل الدخول للوصول إلى هذه الصفحة."
-login_manager.login_message_category = "info"
+.logo-container {
+    flex: 1;
+}
 
-# --- 5. نماذج قاعدة البيانات (Database Models) ---
-class User(UserMixin, db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(80), unique=True, nullable=False)
-    password_hash = db.Column(db.String(200), nullable=False)
-    def set_password(self, password): self.password_hash = generate_password_hash(password)
-    def check_password(self, password): return check_password_hash(self.password_hash, password)
+.logo {
+    max-width: 120px;
+    height: auto;
+}
 
-class Order(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    customer_name = db.Column(db.String(100), nullable=False)
-    customer_phone = db.Column(db.String(20), nullable=False)
-    destination_city = db.Column(db.String(100), nullable=False)
-    shipping_cost = db.Column(db.Float, nullable=False, default=0.0)
-    order_status = db.Column(db.String(50), nullable=False, default='جديد')
-    payment_status = db.Column(db.String(50), nullable=False, default='لم يتم الدفع')
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    products = db.relationship('Product', backref='order', lazy=True, cascade="all, delete-orphan")
-    
-    @property
-    def products_cost(self):
-        return sum(p.quantity * p.price for p in self.products)
-    
-    @property
-    def total_cost(self):
-        return self.products_cost + self.shipping_cost
+.invoice-info {
+    flex: 1;
+    text-align: left;
+    direction: ltr;
+}
+
+.invoice-info h1 {
+    color: #d63384;
+    margin: 0 0 10px 0;
+    font-size: 28px;
+    font-weight: 700;
+}
+
+.invoice-info p {
+    margin: 5px 0;
+    font-size: 16px;
+}
+
+.customer-details {
+    display: flex;
+    justify-content: space-between;
+    margin-bottom: 30px;
+    gap: 20px;
+}
+
+.bill-to, .payment-info {
+    flex: 1;
+    background-color: #f8f9fa;
+    padding: 20px;
+    border-radius: 10px;
+    border: 1px solid #e9ecef;
+}
+
+.bill-to h3, .payment-info h3 {
+    color: #d63384;
+    margin-top: 0;
+    margin-bottom: 15px;
+    padding-bottom: 8px;
+    border-bottom: 1px solid #ddd;
+    font-size: 18px;
+    font-weight: 600;
+}
+
+.bill-to p, .payment-info p {
+    margin: 8px 0;
+}
+
+.items-table {
+    width: 100%;
+    border-collapse: collapse;
+    margin: 25px 0;
+    border-radius: 10px;
+    overflow: hidden;
+    box-shadow: 0 2px 5px rgba(0, 0, 0, 0.05);
+}
+
+.items-table th {
+    background-color: #d63384;
+    color: white;
+    padding: 15px;
+    text-align: center;
+    font-weight: 600;
+}
+
+.items-table td {
+    padding: 15px;
+    border-bottom: 1px solid #ddd;
+    text-align: center;
+}
+
+.items-table tr:nth-child(even) {
+    background-color: #f9f9f9;
+}
+
+.text-left {
+    text-align: left;
+}
+
+.text-center {
+    text-align: center;
+}
+
+.text-right {
+    text-align: right;
+}
+
+.totals {
+    width: 100%;
+    margin-top: 25px;
+}
+
+.totals table {
+    width: 50%;
+    margin-left: 50%;
+    border-collapse: collapse;
+    background-color: #f8f9fa;
+    border-radius: 10px;
+    padding: 15px;
+}
+
+.totals td {
+    padding: 12px 15px;
+    border-bottom: 1px solid #eee;
+}
+
+.totals tr:last-child td {
+    border-bottom: none;
+    font-weight: 700;
+    font-size: 18px;
+    color: #d63384;
+}
+
+.footer {
+    text-align: center;
+    margin-top: 40px;
+    padding-top: 20px;
+    border-top: 1px solid #ddd;
+    color: #777;
+    font-size: 14px;
+    background-color: #f8f9fa;
+    padding: 20px;
+    border-radius: 10px;
+    margin-top: 30px;
+}
+
+.thank-you {
+    font-size: 16px;
+    color: #d63384;
+    margin-bottom: 10px;
+    font-weight: 600;
+}
+
+.decoration {
+    text-align: center;
+    margin: 20px 0;
+    color: #d63384;
+    font-size: 24px;
+}
+
+.currency {
+    font-family: 'Cairo', sans-serif;
+    direction: ltr;
+    display: inline-block;
+}
+
+/* تحسينات للطباعة */
+@media print {
+    body {
+        font-size: 12pt;
+    }
+    
+    .invoice-container {
+        padding: 0;
+        max-width: 100%;
+        box-shadow: none;
+    }
+    
+    .header {
+        margin-bottom: 20px;
+    }
+    
+    .customer-details {
+        margin-bottom: 20px;
+    }
+    
+    .items-table {
+        margin: 15px 0;
+    }
+    
+    .items-table th, .items-table td {
+        padding: 10px 12px;
+    }
+    
+    .footer {
+        margin-top: 20px;
+    }
+}
+"""
+INVOICE_CSS_DIGEST = hashlib.sha256(INVOICE_CSS.encode('utf-8')).hexdigest()
+
+# --- 2.2 أنماط الواجهة (Layout Stylesheet) ---
+# تُقدَّم كملف مستقل (/layout.css) يحتفظ به المتصفح بدلاً من تكرارها داخل كل صفحة
+LAYOUT_CSS = """
+:root {
+    --primary-color: #d63384;
+    --primary-hover: #b02a6c;
+    --secondary-color: #6c757d;
+    --success-color: #198754;
+    --danger-color: #dc3545;
+    --warning-color: #ffc107;
+    --info-color: #0dcaf0;
+    --light-color: #f8f9fa;
+    --dark-color: #212529;
+}
+
+body { 
+    font-family: 'Cairo', sans-serif; 
+    background-color: #f8f9fa; 
+    min-height: 100vh;
+    display: flex;
+    flex-direction: column;
+}
+
+.navbar { 
+    background-color: #ffffff; 
+    box-shadow: 0 2px 4px rgba(0,0,0,.1); 
+}
+
+.nav-link.active { 
+    font-weight: bold; 
+    color: var(--primary-color) !important; 
+}
+
+.btn-primary { 
+    background-color: var(--primary-color); 
+    border-color: var(--primary-color); 
+}
+
+.btn-primary:hover { 
+    background-color: var(--primary-hover); 
+    border-color: var(--primary-hover); 
+}
+
+.table-hover tbody tr:hover { 
+    background-color: #f8f9fa; 
+    transition: background-color 0.2s ease;
+}
+
+.spinner-overlay { 
+    position: fixed; 
+    top: 0; 
+    left: 0; 
+    width: 100%; 
+    height: 100%; 
+    background-color: rgba(0,0,0,0.5); 
+    z-index: 1060; 
+    display: none; 
+    justify-content: center; 
+    align-items: center; 
+}
+
+.status-badge { 
+    font-size: 0.9em; 
+    white-space: nowrap;
+}
+
+.status-جديد { 
+    background-color: var(--warning-color) !important; 
+    color: black; 
+}
+
+.status-تم-الشراء { 
+    background-color: var(--info-color) !important; 
+    color: white; 
+}
+
+.status-في-الطريق { 
+    background-color: #fd7e14 !important; 
+    color: white; 
+}
+
+.status-تم-التسليم { 
+    background-color: var(--success-color) !important; 
+    color: white; 
+}
+
+.payment-لم-يتم-الدفع { 
+    background-color: var(--danger-color) !important; 
+    color: white; 
+}
+
+.payment-تم-الدفع { 
+    background-color: var(--success-color) !important; 
+    color: white; 
+}
+
+/* تحسينات عامة للواجهة */
+.card {
+    border-radius: 12px;
+    border: none;
+    box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
+    transition: all 0.3s ease;
+}
+
+.card:hover {
+    box-shadow: 0 8px 15px rgba(0, 0, 0, 0.15);
+}
+
+.btn {
+    border-radius: 8px;
+    font-weight: 600;
+    padding: 0.5rem 1.5rem;
+    transition: all 0.2s ease;
+}
+
+.btn:hover {
+    transform: translateY(-1px);
+}
+
+.table {
+    border-radius: 8px;
+    overflow: hidden;
+}
+
+.table th {
+    background-color: #d63384;
+    color: white;
+    font-weight: 600;
+    padding: 12px 15px;
+}
+
+.table td {
+    padding: 12px 15px;
+    vertical-align: middle;
+}
+
+.form-control, .form-select {
+    border-radius: 8px;
+    padding: 12px 15px;
+    border: 1px solid #ddd;
+    transition: all 0.3s ease;
+}
+
+.form-control:focus, .form-select:focus {
+    border-color: #d63384;
+    box-shadow: 0 0 0 0.2rem rgba(214, 51, 132, 0.25);
+}
+
+.alert {
+    border-radius: 8px;
+    border: none;
+    padding: 15px 20px;
+}
+
+.dropdown-menu {
+    border-radius: 8px;
+    box-shadow: 0 5px 15px rgba(0, 0, 0, 0.1);
+    border: none;
+}
+
+.dropdown-item {
+    padding: 10px 15px;
+    transition: all 0.2s ease;
+}
+
+.dropdown-item:hover {
+    background-color: #f8f9fa;
+}
+
+.currency {
+    font-family: 'Cairo', sans-serif;
+    direction: ltr;
+    display: inline-block;
+    font-weight: 600;
+}
+
+/* تحسينات للهواتف */
+@media (max-width: 768px) {
+    .container {
+        padding-left: 15px;
+        padding-right: 15px;
+    }
+
+    .table-responsive {
+        overflow-x: auto;
+        -webkit-overflow-scrolling: touch;
+        border-radius: 8px;
+    }
+
+    .navbar-brand {
+        font-size: 1.1rem;
+    }
+
+    .btn {
+        padding: 0.375rem 0.75rem;
+        font-size: 0.875rem;
+        width: 100%;
+        margin-bottom: 10px;
+    }
+
+    .card {
+        margin-bottom: 1rem;
+    }
+
+    .dropdown-menu {
+        position: static !important;
+        transform: none !important;
+    }
+}
+
+/* تحسينات للتطبع والطباعة */
+@media print {
+    .navbar, .btn, .dropdown, .spinner-overlay {
+        display: none !important;
+    }
+
+    body {
+        background-color: white;
+        font-size: 12pt;
+    }
+
+    .container {
+        width: 100%;
+        max-width: 100%;
+    }
+}
+
+main {
+    flex: 1;
+}
+
+footer {
+    background-color: var(--dark-color);
+    color: white;
+    padding: 1rem 0;
+    margin-top: auto;
+}
+"""
+LAYOUT_CSS_DIGEST = hashlib.sha256(LAYOUT_CSS.encode('utf-8')).hexdigest()
+
+# خطوط الفاتورة تُقرأ من مجلد static فقط؛ قواعد @font-face تُنشأ للخطوط الموجودة فعلاً
+INVOICE_FONTS = (
+    ('Cairo', 400, 'Cairo-Regular.ttf'),
+    ('Cairo', 700, 'Cairo-Bold.ttf'),
+)
+INVOICE_ASSET_FILES = ('logo.png',) + tuple(filename for _, _, filename in INVOICE_FONTS)
+INVOICE_ASSET_SCHEME = 'asset:'
+
+# --- 3. إعدادات التطبيق الرئيسية ---
+basedir = os.path.abspath(os.path.dirname(__file__))
+DB_NAME = 'app_v7.db'
+STATIC_DIR = os.path.join(basedir, 'static')
+
+app = Flask(__name__, static_folder=STATIC_DIR)
+app.jinja_loader = DictLoader(templates)
+app.config['SECRET_KEY'] = 'a-very-secret-key-for-v7.0'
+# مسارات البيانات إعدادات وليست ثوابت، فتعمل الاختبارات على مجلدات مؤقتة دون لمس القاعدة أو النسخ الحقيقية
+app.config['INSTANCE_DIR'] = os.path.join(basedir, 'instance')
+app.config['BACKUP_DIR'] = os.path.join(basedir, 'backups')
+app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(app.config['INSTANCE_DIR'], DB_NAME)
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_size': 10, 'max_overflow': 10, 'pool_timeout': 30}
+# إعدادات SQLite تُطبق على كل اتصال جديد؛ في وضع WAL لا تحجب عملية الكتابة قراءات لوحة التحكم
+app.config['SQLITE_JOURNAL_MODE'] = 'WAL'
+app.config['SQLITE_SYNCHRONOUS'] = 'NORMAL'
+app.config['SQLITE_CACHE_SIZE_KB'] = 64 * 1024
+app.config['SQLITE_MMAP_SIZE'] = 256 * 1024 * 1024
+app.config['SQLITE_BUSY_TIMEOUT_MS'] = 5000
+# المهام المجدولة لا تبدأ إلا إذا طُلب ذلك صراحة (wsgi.py و python app.py)، وليس عند أوامر flask أو الاستيراد
+app.config['SCHEDULER_ENABLED'] = False
+app.config['STARTUP_BUDGET_MS'] = 1500
+# وضع الإنتاج (wsgi.py): كل القوالب تُترجم عند بدء التشغيل ولا يُعاد فحصها بعد ذلك
+app.config['TEMPLATE_PRECOMPILE'] = False
+app.config['IMPORT_BATCH_ORDERS'] = 500
+app.config['IMPORT_MAX_REPORTED_ERRORS'] = 200
+app.config['EXPORT_BATCH_SIZE'] = 500
+app.config['BULK_STATUS_CHUNK_SIZE'] = 500
+# مفتاح توقيع بطول 256 بت مشتق من SECRET_KEY (HS256 يرفض المفاتيح الأقصر)
+app.config['JWT_SECRET_KEY'] = hashlib.sha256(app.config['SECRET_KEY'].encode()).hexdigest()
+app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=12)
+# النطاقات المسموح لها باستدعاء /api من المتصفح (فارغة = لا يُسمح لأي نطاق خارجي)
+app.config['API_CORS_ORIGINS'] = []
+app.config['SCHEDULER_API_ENABLED'] = True
+app.config['ORDERS_PER_PAGE'] = 50
+app.config['ORDERS_PER_PAGE_MAX'] = 200
+app.config['ORDER_COUNT_CACHE_TTL'] = 60
+app.config['PHONE_COUNTRY_CODES'] = ('249', '966')
+app.config['PHONE_SUFFIX_MIN_DIGITS'] = 4
+# أطول رقم هاتف دولي (E.164): البحث بأرقام أكثر من ذلك لا يُطابق على الهاتف
+app.config['PHONE_MAX_DIGITS'] = 15
+app.config['INVOICE_CACHE_MAX_BYTES'] = 200 * 1024 * 1024
+app.config['INVOICE_RENDER_WORKERS'] = 2
+app.config['INVOICE_RENDER_QUEUE_DEPTH'] = 8
+app.config['INVOICE_RENDER_TIMEOUT'] = 60
+# مهمة فاتورة بقيت معلقة أكثر من هذا (ثوانٍ) تُعتبر فاشلة: العامل الذي استلمها توقف قبل إنهائها
+app.config['INVOICE_JOB_PENDING_TTL'] = 600
+app.config['BULK_INVOICE_MAX_ORDERS'] = 1000
+app.config['BULK_INVOICE_MERGED_TIMEOUT'] = 600
+app.config['BACKUP_PAGES_PER_STEP'] = 256
+app.config['BACKUP_STEP_SLEEP'] = 0.005
+app.config['BACKUP_CHUNK_SIZE'] = 64 * 1024
+app.config['BACKUP_COMPRESSION_LEVEL'] = 6
+# سياسة الاحتفاظ (الجد - الأب - الابن): آخر نسخة من كل يوم/أسبوع/شهر ضمن هذه الأعداد
+app.config['BACKUP_KEEP_DAILY'] = 7
+app.config['BACKUP_KEEP_WEEKLY'] = 4
+app.config['BACKUP_KEEP_MONTHLY'] = 12
+app.config['BACKUP_LEGACY_COMPRESSION'] = 'xz'
+# أقصى مدة (بالثواني) لانتظار انتهاء الطلبات الجارية قبل تبديل قاعدة البيانات عند الاستعادة
+app.config['RESTORE_DRAIN_TIMEOUT'] = 10
+
+
+def instance_path(*parts):
+    return os.path.join(app.config['INSTANCE_DIR'], *parts)
+
+def backup_path(*parts):
+    return os.path.join(app.config['BACKUP_DIR'], *parts)
+
+def invoice_cache_dir():
+    return instance_path('invoice_cache')
+
+def backup_chunk_dir():
+    return backup_path('chunks')
+
+def backup_manifest_dir():
+    return backup_path('manifests')
+
+def database_path():
+    # المسار الفعلي لملف القاعدة كما يستخدمه المحرك (يتبع SQLALCHEMY_DATABASE_URI)
+    return db.engine.url.database
 
-class Product(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    description = db.Column(db.Text, nullable=False)
-    quantity = db.Column(db.Integer, nullable=False, default=1)
-    price = db.Column(db.Float, nullable=False)
-    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False)
+
+# --- 3.1 ملفات الفاتورة المحلية (Invoice Assets) ---
+# إنشاء PDF لا يتصل بالشبكة أبداً: الشعار والخطوط تُحمّل في الذاكرة عند بدء التشغيل وتُقدم عبر asset:
+invoice_assets = {}
+
+def load_invoice_assets():
+    invoice_assets.clear()
+    missing = []
+    for name in INVOICE_ASSET_FILES:
+        try:
+            with open(os.path.join(STATIC_DIR, name), 'rb') as f:
+                invoice_assets[name] = f.read()
+        except FileNotFoundError:
+            missing.append(name)
+    return missing
+
+def invoice_asset_preflight():
+    missing = load_invoice_assets()
+    for name in missing:
+        print(f"Warning: invoice asset missing from {STATIC_DIR}: {name} (run 'flask fetch-invoice-fonts' for fonts)")
+    return missing
+
+def invoice_asset_url(name, url_prefix=INVOICE_ASSET_SCHEME):
+    return f'{url_prefix}{name}' if name in invoice_assets else ''
+
+def invoice_font_css(url_prefix=INVOICE_ASSET_SCHEME):
+    return ''.join(
+        f"@font-face {{ font-family: '{family}'; font-weight: {weight}; src: url('{url_prefix}{filename}'); }}\n"
+        for family, weight, filename in INVOICE_FONTS if filename in invoice_assets
+    )
+
+def invoice_url_fetcher(url, timeout=10, ssl_context=None):
+    if url.startswith(INVOICE_ASSET_SCHEME):
+        name = url[len(INVOICE_ASSET_SCHEME):].lstrip('/')
+        if name in invoice_assets:
+            return {
+                'string': invoice_assets[name],
+                'mime_type': mimetypes.guess_type(name)[0] or 'application/octet-stream',
+                'redirected_url': url,
+            }
+    elif url.startswith('data:'):
+        from weasyprint import default_url_fetcher
+        return default_url_fetcher(url, timeout=timeout, ssl_context=ssl_context)
+    raise ValueError(f'Invoice rendering is offline, refusing to fetch {url}')
+
+# --- 4. تهيئة الإضافات (Extensions) ---
+db = SQLAlchemy()
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA busy_timeout = {int(app.config['SQLITE_BUSY_TIMEOUT_MS'])}")
+    cursor.execute(f"PRAGMA journal_mode = {app.config['SQLITE_JOURNAL_MODE']}")
+    cursor.execute(f"PRAGMA synchronous = {app.config['SQLITE_SYNCHRONOUS']}")
+    # القيمة السالبة تعني الحجم بالكيلوبايت بدل عدد الصفحات
+    cursor.execute(f"PRAGMA cache_size = -{int(app.config['SQLITE_CACHE_SIZE_KB'])}")
+    cursor.execute(f"PRAGMA mmap_size = {int(app.config['SQLITE_MMAP_SIZE'])}")
+    cursor.execute("PRAGMA temp_store = MEMORY")
+    cursor.close()
+
+scheduler = APScheduler()
+
+def acquire_file_lock(path, blocking, shared=False):
+    # القفل يبقى ما دام الملف مفتوحاً، ويحرره نظام التشغيل تلقائياً إذا توقفت العملية
+    lock_file = open(path, 'a')
+    if fcntl is None:
+        return lock_file
+    try:
+        fcntl.flock(lock_file, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | (0 if blocking else fcntl.LOCK_NB))
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    return lock_file
+
+def acquire_file_lock_within(path, timeout):
+    # flock لا يدعم مهلة انتظار، فتُكرر المحاولة دون حجب حتى تنتهي المهلة
+    deadline = time.monotonic() + timeout
+    while True:
+        lock_file = acquire_file_lock(path, blocking=False)
+        if lock_file or time.monotonic() >= deadline:
+            return lock_file
+        time.sleep(0.01)
+
+scheduler_lock = None
+
+def start_scheduler_when_leader():
+    # مع عدة عمال (gunicorn) تشغّل عملية واحدة فقط المهام المجدولة؛ البقية تنتظر القفل لتتولى المهمة إذا توقفت القائدة
+    def become_leader(lock_file):
+        global scheduler_lock
+        scheduler_lock = lock_file
+        scheduler.start()
+        print(f"Scheduler started in process {os.getpid()}")
+
+    lock_file = acquire_file_lock(instance_path('scheduler.lock'), blocking=False)
+    if lock_file:
+        become_leader(lock_file)
+        return
+    threading.Thread(
+        target=lambda: become_leader(acquire_file_lock(instance_path('scheduler.lock'), blocking=True)),
+        name='scheduler-leader-election',
+        daemon=True
+    ).start()
+
+login_manager = LoginManager()
+login_manager.login_view = 'login'
+login_manager.login_message = "الرجاء تسجيل الدخول للوصول إلى هذه الصفحة."
+login_manager.login_message_category = "info"
+jwt = JWTManager()
+cors = CORS()
+
+# --- 3.2 القوالب (Templates) ---
+app.add_template_global(LAYOUT_CSS_DIGEST[:12], 'layout_css_version')
+
+def precompile_templates():
+    # خطأ صياغة في أي قالب يوقف التشغيل هنا بدلاً من أن يظهر عند أول زيارة للصفحة
+    names = app.jinja_env.list_templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+@app.route('/layout.css')
+def layout_css():
+    # الرابط يحمل بصمة الأنماط (?v=)، لذلك يمكن للمتصفح الاحتفاظ به لمدة طويلة
+    response = make_response(LAYOUT_CSS)
+    response.mimetype = 'text/css'
+    response.set_etag(LAYOUT_CSS_DIGEST)
+    response.cache_control.public = True
+    response.cache_control.max_age = 365 * 24 * 3600
+    return response.make_conditional(request)
+
+def create_app(config=None):
+    # الاستيراد لا يُنشئ مجلدات ولا اتصالات؛ كل ذلك هنا، بعد تطبيق الإعدادات الإضافية (مثل قاعدة بيانات مؤقتة)
+    # المسارات والدوال معرّفة على كائن app الوحيد في الوحدة؛ استدعاء ثانٍ بإعدادات أخرى يعيد توجيهه إليها
+    initialized = 'sqlalchemy' in app.extensions
+    if initialized and not config:
+        return app
+    app.config.update(config or {})
+    for directory in (instance_path(), app.config['BACKUP_DIR'], backup_chunk_dir(), backup_manifest_dir(),
+                      STATIC_DIR, invoice_cache_dir(), instance_path('jinja_cache')):
+        os.makedirs(directory, exist_ok=True)
+    invoice_asset_preflight()
+    # الكود المترجم للقوالب يُحفظ على القرص ويُعاد استخدامه بعد إعادة تشغيل العمال (المفتاح يشمل بصمة المصدر)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(instance_path('jinja_cache'))
+    if app.config['TEMPLATE_PRECOMPILE']:
+        app.jinja_env.auto_reload = False
+        precompile_templates()
+    if initialized:
+        reset_database_engine()
+    else:
+        db.init_app(app)
+        login_manager.init_app(app)
+        jwt.init_app(app)
+        cors.init_app(app, resources={r'/api/*': {
+            'origins': app.config['API_CORS_ORIGINS'], 'expose_headers': ['ETag'], 'allow_headers': ['Authorization', 'If-None-Match']
+        }})
+        scheduler.init_app(app)
+    with app.app_context():
+        event.listen(db.engine, 'connect', apply_sqlite_pragmas)
+    if app.config['SCHEDULER_ENABLED'] and not scheduler.running:
+        start_scheduler_when_leader()
+    return app
+
+def reset_database_engine():
+    # إعادة init_app تُغلق المحرك القديم وتنشئ محركاً للرابط الجديد، لكنها تسجل دوال teardown و shell مرة أخرى،
+    # وFlask يرفض ذلك بعد أول طلب؛ المسجلة في الاستدعاء الأول تكفي فيُتجاوز تسجيلها هنا
+    del app.extensions['sqlalchemy']
+    app.teardown_appcontext = app.shell_context_processor = lambda f: f
+    try:
+        db.init_app(app)
+    finally:
+        del app.teardown_appcontext, app.shell_context_processor
+    reset_process_caches()
+
+# --- 5. نماذج قاعدة البيانات (Database Models) ---
+class User(UserMixin, db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(80), unique=True, nullable=False)
+    password_hash = db.Column(db.String(200), nullable=False)
+    def set_password(self, password): self.password_hash = generate_password_hash(password)
+    def check_password(self, password): return check_password_hash(self.password_hash, password)
+
+def normalize_phone(value):
+    # أرقام فقط، بدون 00 أو رمز الدولة أو الصفر المحلي: +249 912 345 678 و 0912345678 => 912345678
+    digits = re.sub(r'\D', '', value or '')
+    if digits.startswith('00'):
+        digits = digits[2:]
+    for country_code in app.config['PHONE_COUNTRY_CODES']:
+        if digits.startswith(country_code) and len(digits) - len(country_code) >= 9:
+            digits = digits[len(country_code):]
+            break
+    if digits.startswith('0') and len(digits) > 9:
+        digits = digits[1:]
+    return digits
+
+class Order(db.Model):
+    # فهارس مركبة تطابق فلاتر لوحة التحكم مع الترتيب على created_at
+    __table_args__ = (
+        db.Index('ix_order_created_at', 'created_at'),
+        db.Index('ix_order_order_status_created_at', 'order_status', 'created_at'),
+        db.Index('ix_order_payment_status_created_at', 'payment_status', 'created_at'),
+        db.Index('ix_order_statuses_created_at', 'order_status', 'payment_status', 'created_at'),
+        db.Index('ix_order_destination_city', 'destination_city'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    customer_name = db.Column(db.String(100), nullable=False)
+    customer_phone = db.Column(db.String(20), nullable=False)
+    destination_city = db.Column(db.String(100), nullable=False)
+    shipping_cost = db.Column(db.Float, nullable=False, default=0.0)
+    order_status = db.Column(db.String(50), nullable=False, default='جديد')
+    payment_status = db.Column(db.String(50), nullable=False, default='لم يتم الدفع')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # قيم مخزنة مسبقاً حتى لا تحتاج صفحات القوائم إلى تحميل المنتجات
+    products_cost = db.Column(db.Float, nullable=False, default=0.0)
+    total_cost = db.Column(db.Float, nullable=False, default=0.0)
+    # الرقم بعد التطبيع ومقلوبه؛ البحث بآخر الأرقام يصبح بحثاً بالبادئة على فهرس phone_reversed
+    phone_digits = db.Column(db.String(20), nullable=False, default='')
+    phone_reversed = db.Column(db.String(20), nullable=False, default='', index=True)
+    # يزداد مع كل تعديل على الطلب أو منتجاته (bump_order_versions)؛ واجهة API تبني ETag منه
+    version = db.Column(db.Integer, nullable=False, default=1)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    products = db.relationship('Product', backref='order', lazy=True, cascade="all, delete-orphan")
+    
+    @validates('customer_phone')
+    def normalize_customer_phone(self, key, value):
+        self.phone_digits = normalize_phone(value)
+        self.phone_reversed = self.phone_digits[::-1]
+        return value
+    
+    def refresh_costs(self, products=None):
+        products = self.products if products is None else products
+        self.products_cost = sum(p.quantity * p.price for p in products)
+        self.total_cost = self.products_cost + self.shipping_cost
+
+class Product(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    description = db.Column(db.Text, nullable=False)
+    quantity = db.Column(db.Integer, nullable=False, default=1)
+    price = db.Column(db.Float, nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False, index=True)
+
+class OrderStatsRollup(db.Model):
+    # ملخص تراكمي لكل (يوم × مدينة × حالة الطلب × حالة الدفع) يُحدّث مع كل كتابة على الطلبات
+    __tablename__ = 'order_stats_rollup'
+    __table_args__ = (
+        db.UniqueConstraint('day', 'destination_city', 'order_status', 'payment_status', name='uq_order_stats_rollup_key'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    destination_city = db.Column(db.String(100), nullable=False)
+    order_status = db.Column(db.String(50), nullable=False)
+    payment_status = db.Column(db.String(50), nullable=False)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    products_revenue = db.Column(db.Float, nullable=False, default=0.0)
+    shipping_revenue = db.Column(db.Float, nullable=False, default=0.0)
 
 @login_manager.user_loader
 def load_user(user_id):
     return db.session.get(User, int(user_id))
 
+# --- 5.1 ترحيل مخطط قاعدة البيانات (Schema Migrations) ---
+# db.create_all() لا يعدّل الجداول الموجودة، لذلك تُضاف الأعمدة الجديدة هنا لملفات app_v7.db القديمة
+SCHEMA_COLUMNS = {
+    'order': {
+        'products_cost': 'FLOAT NOT NULL DEFAULT 0.0',
+        'total_cost': 'FLOAT NOT NULL DEFAULT 0.0',
+        'phone_digits': "VARCHAR(20) NOT NULL DEFAULT ''",
+        'phone_reversed': "VARCHAR(20) NOT NULL DEFAULT ''",
+        'version': 'INTEGER NOT NULL DEFAULT 1',
+        'updated_at': 'DATETIME',
+    },
+}
+
+def backfill_order_costs():
+    products_sum = db.session.query(
+        func.coalesce(func.sum(Product.quantity * Product.price), 0.0)
+    ).filter(Product.order_id == Order.id).scalar_subquery()
+    result = db.session.execute(
+        update(Order).values(
+            products_cost=products_sum,
+            total_cost=products_sum + Order.shipping_cost
+        ).execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount
+
+def backfill_phone_columns(batch_size=1000):
+    updated = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(Order.id, Order.customer_phone).where(Order.id > last_id).order_by(Order.id).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        params = []
+        for order_id, phone in rows:
+            digits = normalize_phone(phone)
+            params.append({'order_id': order_id, 'phone_digits': digits, 'phone_reversed': digits[::-1]})
+        db.session.execute(text(
+            'UPDATE "order" SET phone_digits = :phone_digits, phone_reversed = :phone_reversed WHERE id = :order_id'
+        ), params)
+        db.session.commit()
+        updated += len(rows)
+        last_id = rows[-1][0]
+    return updated
+
+def order_rollup_values(order):
+    # طلب بدون تاريخ إنشاء (بيانات قديمة أو مستوردة) لا يدخل الملخص في أي مسار، كما في rebuild_stats_rollup
+    if order.created_at is None:
+        return None
+    return {
+        'day': order.created_at.date(),
+        'destination_city': order.destination_city,
+        'order_status': order.order_status,
+        'payment_status': order.payment_status,
+        'products_revenue': order.products_cost or 0.0,
+        'shipping_revenue': order.shipping_cost or 0.0,
+    }
+
+def rollup_delta(values, sign, count=1):
+    # sign = 1 عند إضافة الطلب إلى الملخص و -1 عند إزالته
+    # count > 1 عندما تكون القيم مجموع عدة طلبات تشترك في نفس المفتاح (الاستيراد بالجملة)
+    return {
+        'day': values['day'],
+        'destination_city': values['destination_city'],
+        'order_status': values['order_status'],
+        'payment_status': values['payment_status'],
+        'order_count': sign * count,
+        'products_revenue': sign * values['products_revenue'],
+        'shipping_revenue': sign * values['shipping_revenue'],
+    }
+
+def apply_stats_rollup_deltas(deltas):
+    # upsert واحد بـ executemany لكل الصفوف؛ يُنفذ ضمن نفس المعاملة
+    stmt = sqlite_insert(OrderStatsRollup)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['day', 'destination_city', 'order_status', 'payment_status'],
+        set_={
+            'order_count': OrderStatsRollup.order_count + stmt.excluded.order_count,
+            'products_revenue': OrderStatsRollup.products_revenue + stmt.excluded.products_revenue,
+            'shipping_revenue': OrderStatsRollup.shipping_revenue + stmt.excluded.shipping_revenue,
+        }
+    )
+    db.session.execute(stmt, deltas)
+
+def update_stats_rollup(values, sign):
+    if values is not None:
+        apply_stats_rollup_deltas([rollup_delta(values, sign)])
+
+def rebuild_stats_rollup():
+    day = func.date(Order.created_at)
+    db.session.execute(delete(OrderStatsRollup))
+    db.session.execute(insert(OrderStatsRollup).from_select(
+        ['day', 'destination_city', 'order_status', 'payment_status',
+         'order_count', 'products_revenue', 'shipping_revenue'],
+        select(
+            day, Order.destination_city, Order.order_status, Order.payment_status,
+            func.count(Order.id), func.sum(Order.products_cost), func.sum(Order.shipping_cost)
+        ).where(Order.created_at.is_not(None)).group_by(
+            day, Order.destination_city, Order.order_status, Order.payment_status
+        )
+    ))
+    db.session.commit()
+    return db.session.query(func.count(OrderStatsRollup.id)).scalar()
+
+# --- 5.2 فهرس البحث النصي (SQLite FTS5) ---
+# النصوص تُطبّع قبل الفهرسة وقبل البحث حتى تتطابق أشكال الكتابة العربية المختلفة
+ARABIC_DIACRITICS_RE = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+ARABIC_LETTER_FORMS = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ؤ': 'و', 'ئ': 'ي', 'ى': 'ي', 'ة': 'ه',
+})
+
+def normalize_arabic(value):
+    return ARABIC_DIACRITICS_RE.sub('', value or '').translate(ARABIC_LETTER_FORMS).lower()
+
+def build_fts_query(search_term):
+    tokens = normalize_arabic(search_term).split()
+    return ' '.join('"{}"*'.format(token.replace('"', '""')) for token in tokens)
+
+def order_search_subquery(fts_query):
+    # bm25 يعطي قيمة أصغر للنتيجة الأفضل، لذلك نعكس الإشارة ليكون الترتيب تنازلياً
+    return select(
+        literal_column('order_search.rowid').label('order_id'),
+        (-func.bm25(literal_column('order_search'), 10.0, 5.0, 2.0, 1.0)).label('score')
+    ).select_from(text('order_search')).where(text('order_search MATCH :fts_query')) \
+        .params(fts_query=fts_query).subquery('order_search_match')
+
+def create_search_index(conn):
+    conn.execute(text(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS order_search USING fts5("
+        "customer_name, customer_phone, destination_city, products, "
+        "tokenize = 'unicode61 remove_diacritics 2')"
+    ))
+
+@event.listens_for(db.metadata, 'after_create')
+def create_search_index_with_tables(target, connection, **kw):
+    create_search_index(connection)
+
+def refresh_order_search(conn, order_ids=None, deleted_ids=()):
+    # order_ids = None تعني إعادة بناء الفهرس بالكامل
+    stale_ids = list(deleted_ids) + list(order_ids or [])
+    if order_ids is None:
+        conn.execute(text("DELETE FROM order_search"))
+    elif stale_ids:
+        conn.execute(text("DELETE FROM order_search WHERE rowid IN ({})".format(
+            ','.join(str(int(order_id)) for order_id in stale_ids))))
+    if order_ids is not None and not order_ids:
+        return 0
+    sql = (
+        'SELECT o.id, o.customer_name, o.customer_phone, o.destination_city, '
+        "group_concat(p.description, ' ') FROM \"order\" o "
+        'LEFT JOIN product p ON p.order_id = o.id'
+    )
+    if order_ids is not None:
+        sql += ' WHERE o.id IN ({})'.format(','.join(str(int(order_id)) for order_id in order_ids))
+    sql += ' GROUP BY o.id'
+    rows = [
+        {'rowid': order_id, 'customer_name': normalize_arabic(name), 'customer_phone': phone or '',
+         'destination_city': normalize_arabic(city), 'products': normalize_arabic(products)}
+        for order_id, name, phone, city, products in conn.execute(text(sql))
+    ]
+    if rows:
+        conn.execute(text(
+            'INSERT INTO order_search(rowid, customer_name, customer_phone, destination_city, products) '
+            'VALUES (:rowid, :customer_name, :customer_phone, :destination_city, :products)'
+        ), rows)
+    return len(rows)
+
+# الحقول التي يُبنى منها صف order_search؛ تعديل غيرها (الحالة، الأسعار...) لا يستدعي إعادة فهرسة الطلب
+ORDER_SEARCH_SOURCE_FIELDS = {
+    Order: ('customer_name', 'customer_phone', 'destination_city'),
+    Product: ('description', 'order_id', 'order'),
+}
+
+def search_source_modified(obj):
+    state = inspect(obj)
+    return any(state.attrs[name].history.has_changes() for name in ORDER_SEARCH_SOURCE_FIELDS[type(obj)])
+
+def changed_order_ids(session, search_fields_only=False):
+    # الطلبات التي تأثرت بعملية flush الحالية: (طلبات أُضيفت أو عُدلت، طلبات حُذفت)
+    order_ids, deleted_ids = set(), set()
+    for obj in session.new | session.dirty:
+        # session.dirty يشمل كائنات أُعيد تعيين حقولها بنفس القيم؛ هذه لا تُعد تعديلاً
+        if obj in session.dirty and not session.is_modified(obj, include_collections=False):
+            continue
+        if search_fields_only and obj in session.dirty and isinstance(obj, (Order, Product)) \
+                and not search_source_modified(obj):
+            continue
+        if isinstance(obj, Order):
+            order_ids.add(obj.id)
+        elif isinstance(obj, Product):
+            order_ids.add(obj.order_id)
+    for obj in session.deleted:
+        if isinstance(obj, Order):
+            deleted_ids.add(obj.id)
+        elif isinstance(obj, Product):
+            order_ids.add(obj.order_id)
+    order_ids -= deleted_ids
+    order_ids.discard(None)
+    return order_ids, deleted_ids
+
+@event.listens_for(db.session, 'after_flush')
+def sync_order_search(session, flush_context):
+    # يُحدّث الفهرس داخل نفس المعاملة لكل طلب أو منتج تمت إضافته أو حذفه أو تعديل حقل مفهرس فيه
+    indexed_ids, deleted_ids = changed_order_ids(session, search_fields_only=True)
+    if indexed_ids or deleted_ids:
+        refresh_order_search(session.connection(), indexed_ids, deleted_ids)
+    # الفاتورة تعتمد على كل حقول الطلب، فتُلغى نسختها المخزنة لأي تعديل
+    order_ids, _ = changed_order_ids(session)
+    session.info.setdefault('changed_order_ids', set()).update(order_ids | deleted_ids)
+
+@event.listens_for(db.session, 'after_flush')
+def collect_versioned_orders(session, flush_context):
+    # تعديل منتج وحده لا يغيّر صف الطلب، لذلك تُجمع الطلبات المتأثرة هنا ويُرفع رقم نسختها عند commit
+    order_ids, _ = changed_order_ids(session)
+    session.info.setdefault('versioned_order_ids', set()).update(order_ids)
+    session.info.setdefault('created_order_ids', set()).update(
+        obj.id for obj in session.new if isinstance(obj, Order)
+    )
+
+@event.listens_for(db.session, 'before_commit')
+def bump_order_versions(session):
+    # مرة واحدة لكل commit مهما تعدد الـ flush داخله (التحميل الكسول وupsert الملخص يسببان flush تلقائياً)؛
+    # الطلب الجديد يبقى على النسخة 1. flush هنا لأن commit يُنفذ الـ flush الأخير بعد before_commit
+    session.flush()
+    order_ids = session.info.pop('versioned_order_ids', set()) - session.info.pop('created_order_ids', set())
+    if order_ids:
+        order_table = Order.__table__
+        session.connection().execute(
+            update(order_table).where(order_table.c.id.in_(order_ids))
+            .values(version=order_table.c.version + 1, updated_at=datetime.utcnow())
+        )
+
+@event.listens_for(db.session, 'after_commit')
+def purge_changed_invoices(session):
+    changed_ids = session.info.pop('changed_order_ids', None)
+    if changed_ids:
+        invalidate_invoice_caches(changed_ids)
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_changed_invoices(session):
+    session.info.pop('changed_order_ids', None)
+    session.info.pop('versioned_order_ids', None)
+    session.info.pop('created_order_ids', None)
+
+def rebuild_search_index():
+    with db.engine.begin() as conn:
+        create_search_index(conn)
+        return refresh_order_search(conn)
+
+def run_schema_migrations():
+    added_columns = []
+    with db.engine.begin() as conn:
+        for table, columns in SCHEMA_COLUMNS.items():
+            existing = {row[1] for row in conn.execute(text(f'PRAGMA table_info("{table}")'))}
+            for column, ddl in columns.items():
+                if column not in existing:
+                    conn.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {column} {ddl}'))
+                    added_columns.append(f'{table}.{column}')
+    # الفهارس المعرّفة في النماذج لا يُنشئها create_all على الجداول الموجودة مسبقاً
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+    if 'order.updated_at' in added_columns:
+        with db.engine.begin() as conn:
+            conn.execute(text('UPDATE "order" SET updated_at = created_at WHERE updated_at IS NULL'))
+    if 'order.products_cost' in added_columns:
+        backfill_order_costs()
+    if 'order.phone_reversed' in added_columns:
+        backfill_phone_columns()
+    # فهرس البحث وجدول الملخص جديدان على قواعد البيانات القديمة، فيُبنيان مرة واحدة إذا كانا فارغين
+    if db.session.query(Order.id).first():
+        if not db.session.execute(text("SELECT 1 FROM order_search LIMIT 1")).first():
+            rebuild_search_index()
+            added_columns.append('order_search (rebuilt)')
+        if not db.session.query(OrderStatsRollup.id).first():
+            rebuild_stats_rollup()
+            added_columns.append('order_stats_rollup (rebuilt)')
+    return added_columns
+
+@app.cli.command('migrate-db')
+def migrate_db_command():
+    db.create_all()
+    added_columns = run_schema_migrations()
+    print(f"Schema up to date. Added columns: {', '.join(added_columns) or 'none'}")
+
+@app.cli.command('backfill-order-costs')
+def backfill_order_costs_command():
+    updated = backfill_order_costs()
+    print(f"Recalculated stored costs for {updated} orders.")
+
+@app.cli.command('backfill-phone-columns')
+def backfill_phone_columns_command():
+    updated = backfill_phone_columns()
+    print(f"Normalized phone numbers for {updated} orders.")
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    indexed = rebuild_search_index()
+    print(f"Search index rebuilt for {indexed} orders.")
+
+@app.cli.command('rebuild-stats-rollup')
+def rebuild_stats_rollup_command():
+    rows = rebuild_stats_rollup()
+    print(f"Statistics rollup rebuilt with {rows} rows.")
+
 # =======================================================================
 # | الجزء الثاني: منطق التطبيق والواجهات (Application Logic & Views)     |
 # =======================================================================
@@ -1121,31 +1909,187 @@ def logout():
     flash('تم تسجيل الخروج بنجاح.', 'success')
     return redirect(url_for('login'))
 
+# --- دوال مساعدة لتقسيم صفحات الطلبات (Keyset Pagination) ---
+ORDER_FILTER_KEYS = ('search_term', 'order_status', 'payment_status', 'destination_city', 'date_from', 'date_to')
+_order_count_cache = {}
+
+def get_order_filters(args):
+    filters = {key: args.get(key, '').strip() for key in ORDER_FILTER_KEYS if args.get(key, '').strip()}
+    for key in ('date_from', 'date_to'):
+        if key in filters:
+            try:
+                date.fromisoformat(filters[key])
+            except ValueError:
+                del filters[key]
+    return filters
+
+# INTEGER في SQLite بـ 64 بت؛ ربط رقم خارج هذا المدى يرفع OverflowError
+SQLITE_MAX_INTEGER = 2**63 - 1
+
+def fits_sqlite_integer(value):
+    return -SQLITE_MAX_INTEGER - 1 <= value <= SQLITE_MAX_INTEGER
+
+def search_order_id(digits):
+    # رقم أطول من 19 خانة لا يمكن أن يكون رقم طلب، ولا داعي لتحويله
+    if len(digits) > 19 or not fits_sqlite_integer(int(digits)):
+        return None
+    return int(digits)
+
+def get_search_digits(search_term):
+    # البحث الرقمي (رقم طلب أو آخر أرقام الهاتف) يُعامل بشكل منفصل عن البحث النصي
+    if not search_term or not re.fullmatch(r'[\d\s+()-]+', search_term):
+        return None
+    digits = re.sub(r'\D', '', search_term)
+    return digits or None
+
+def numeric_search_condition(digits):
+    conditions = []
+    order_id = search_order_id(digits)
+    if order_id is not None:
+        conditions.append(Order.id == order_id)
+    suffix = normalize_phone(digits) if len(digits) > 9 else digits
+    if app.config['PHONE_SUFFIX_MIN_DIGITS'] <= len(suffix) <= app.config['PHONE_MAX_DIGITS']:
+        # كل الأرقام أقل من ':' لذلك النطاق [suffix, suffix + ':') يطابق كل ما يبدأ بها
+        reversed_suffix = suffix[::-1]
+        conditions.append(Order.phone_reversed.between(reversed_suffix, reversed_suffix + ':'))
+    return or_(false(), *conditions)
+
+def apply_order_filters(query, filters):
+    search_term = filters.get('search_term')
+    search_digits = get_search_digits(search_term)
+    if search_digits:
+        query = query.filter(numeric_search_condition(search_digits))
+    elif search_term and build_fts_query(search_term):
+        search = order_search_subquery(build_fts_query(search_term))
+        query = query.filter(Order.id.in_(select(search.c.order_id)))
+    if filters.get('order_status'):
+        query = query.filter(Order.order_status == filters['order_status'])
+    if filters.get('payment_status'):
+        query = query.filter(Order.payment_status == filters['payment_status'])
+    if filters.get('destination_city'):
+        query = query.filter(Order.destination_city == filters['destination_city'])
+    if filters.get('date_from'):
+        query = query.filter(Order.created_at >= datetime.fromisoformat(filters['date_from']))
+    if filters.get('date_to'):
+        query = query.filter(Order.created_at < datetime.fromisoformat(filters['date_to']) + timedelta(days=1))
+    return query
+
+def encode_cursor(sort_value, order_id):
+    if isinstance(sort_value, datetime):
+        sort_value = sort_value.isoformat()
+    return f"{sort_value}_{order_id}"
+
+def decode_cursor(cursor, parse=datetime.fromisoformat):
+    # المؤشر بالشكل: <قيمة عمود الترتيب>_<id>
+    if not cursor:
+        return None
+    try:
+        sort_value, order_id = cursor.rsplit('_', 1)
+        sort_value, order_id = parse(sort_value), int(order_id)
+    except ValueError:
+        return None
+    # مؤشر معدّل بأرقام خارج مدى SQLite يُعامل كأنه غير موجود بدلاً من خطأ 500
+    if not fits_sqlite_integer(order_id) or (isinstance(sort_value, int) and not fits_sqlite_integer(sort_value)):
+        return None
+    return sort_value, order_id
+
+def paginate_orders(query, page_size, after=None, before=None, sort_column=None):
+    # الترتيب دائماً تنازلي على (sort_column, id) حتى تكون الصفحات ثابتة؛ الافتراضي تاريخ الإنشاء
+    sort_column = Order.created_at if sort_column is None else sort_column
+    query = query.add_columns(sort_column)
+    sort_key = tuple_(sort_column, Order.id)
+    if before:
+        rows = query.filter(sort_key > before) \
+            .order_by(sort_column.asc(), Order.id.asc()).limit(page_size + 1).all()
+        has_prev = len(rows) > page_size
+        rows = list(reversed(rows[:page_size]))
+        has_next = True
+    else:
+        if after:
+            query = query.filter(sort_key < after)
+        rows = query.order_by(sort_column.desc(), Order.id.desc()).limit(page_size + 1).all()
+        has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        has_prev = after is not None
+    return {
+        'items': [row[0] for row in rows],
+        'next_cursor': encode_cursor(rows[-1][1], rows[-1][0].id) if rows and has_next else None,
+        'prev_cursor': encode_cursor(rows[0][1], rows[0][0].id) if rows and has_prev else None,
+    }
+
+def count_orders_cached(query, filters):
+    # العدد الكلي يُحسب باستعلام منفصل ويُخزن مؤقتاً حتى لا يبطئ عرض الصفحة
+    cache_key = tuple(sorted(filters.items()))
+    cached = _order_count_cache.get(cache_key)
+    now = time.monotonic()
+    if cached and now - cached[1] < app.config['ORDER_COUNT_CACHE_TTL']:
+        return cached[0]
+    total = query.order_by(None).count()
+    _order_count_cache[cache_key] = (total, now)
+    return total
+
+def invalidate_order_count_cache():
+    _order_count_cache.clear()
+
+def get_page_size(args):
+    page_size = args.get('per_page', app.config['ORDERS_PER_PAGE'], type=int)
+    return max(1, min(page_size, app.config['ORDERS_PER_PAGE_MAX']))
+
+def build_order_listing(filters):
+    # يعيد (الاستعلام، عمود الترتيب، دالة قراءة المؤشر) حسب نوع البحث؛ تستخدمه لوحة التحكم وواجهة API
+    search_term = filters.get('search_term', '')
+    search_digits = get_search_digits(search_term)
+    fts_query = build_fts_query(search_term) if not search_digits else ''
+
+    if search_digits:
+        # التطابق التام مع رقم الطلب يظهر أولاً ثم مطابقات آخر أرقام الهاتف
+        query = apply_order_filters(Order.query, filters)
+        order_id = search_order_id(search_digits)
+        sort_column = case((Order.id == order_id, 1), else_=0) if order_id is not None else literal(0)
+        parse_cursor = int
+    elif fts_query:
+        # البحث النصي يُرتب حسب الصلة بدلاً من التاريخ
+        search = order_search_subquery(fts_query)
+        query = apply_order_filters(Order.query, {k: v for k, v in filters.items() if k != 'search_term'}) \
+            .join(search, search.c.order_id == Order.id)
+        sort_column, parse_cursor = search.c.score, float
+    else:
+        query = apply_order_filters(Order.query, filters)
+        sort_column, parse_cursor = Order.created_at, datetime.fromisoformat
+    return query, sort_column, parse_cursor
+
 @app.route('/')
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    query = Order.query
-    search_term = request.args.get('search_term')
-    order_status = request.args.get('order_status')
-    payment_status = request.args.get('payment_status')
-
-    if search_term:
-        search_pattern = f"%{search_term}%"
-        query = query.filter(
-            or_(
-                Order.customer_name.ilike(search_pattern),
-                Order.customer_phone.ilike(search_pattern),
-                Order.id.like(search_pattern)
-            )
-        )
-    if order_status:
-        query = query.filter(Order.order_status == order_status)
-    if payment_status:
-        query = query.filter(Order.payment_status == payment_status)
+    filters = get_order_filters(request.args)
+    query, sort_column, parse_cursor = build_order_listing(filters)
+    page = paginate_orders(
+        query,
+        get_page_size(request.args),
+        after=decode_cursor(request.args.get('after'), parse_cursor),
+        before=decode_cursor(request.args.get('before'), parse_cursor),
+        sort_column=sort_column
+    )
+
+    show_total = request.args.get('show_total') == '1'
+    total_orders = count_orders_cached(query, filters) if show_total else None
+
+    page_args = dict(filters)
+    if show_total:
+        page_args['show_total'] = '1'
+    if 'per_page' in request.args:
+        page_args['per_page'] = get_page_size(request.args)
 
-    filtered_orders = query.order_by(Order.created_at.desc()).all()
-    return render_template("dashboard.html", orders=filtered_orders)
+    return render_template(
+        "dashboard.html",
+        orders=page['items'],
+        next_cursor=page['next_cursor'],
+        prev_cursor=page['prev_cursor'],
+        page_args=page_args,
+        filters=filters,
+        total_orders=total_orders
+    )
 
 @app.route('/order/add', methods=['GET', 'POST'])
 @login_required
@@ -1175,41 +2119,63 @@ def add_order():
                     order=new_order
                 ))
         
+        new_order.refresh_costs()
+        db.session.flush()
+        update_stats_rollup(order_rollup_values(new_order), 1)
         db.session.commit()
+        invalidate_order_count_cache()
         flash('تم إنشاء الطلب بنجاح!', 'success')
         return redirect(url_for('dashboard'))
     return render_template("order_form.html", order=None)
 
+def sync_order_products(order, form):
+    # يقارن منتجات النموذج بالمنتجات المحفوظة عبر product_id: يضيف الجديد ويحذف المُزال
+    # ولا يلمس إلا الحقول التي تغيرت فعلاً، فتبقى معرّفات المنتجات ثابتة ولا يُكتب شيء إن لم يتغير شيء
+    existing = {product.id: product for product in order.products}
+    product_names = form.getlist('product_name')
+    product_ids = form.getlist('product_id')
+    product_ids += [''] * (len(product_names) - len(product_ids))
+    products = []
+    for product_id, name, quantity, price in zip(product_ids, product_names,
+                                                 form.getlist('product_quantity'), form.getlist('product_price')):
+        if not (name and quantity and price):
+            continue
+        product = existing.pop(int(product_id), None) if product_id.isdigit() else None
+        if product is None:
+            product = Product(order=order)
+            db.session.add(product)
+        values = {'description': name, 'quantity': int(quantity), 'price': float(price)}
+        for field, value in values.items():
+            if getattr(product, field) != value:
+                setattr(product, field, value)
+        products.append(product)
+    for product in existing.values():
+        order.products.remove(product)
+    return products
+
 @app.route('/order/edit/<int:order_id>', methods=['GET', 'POST'])
-@login_required
-def edit_order(order_id):
-    order_to_edit = Order.query.get_or_404(order_id)
-    if request.method == 'POST':
-        form = request.form
-        order_to_edit.customer_name = form['customer_name']
-        order_to_edit.customer_phone = form['customer_phone']
-        order_to_edit.destination_city = form['destination_city']
-        order_to_edit.shipping_cost = float(form['shipping_cost'])
-        order_to_edit.order_status = form['order_status']
-        order_to_edit.payment_status = form['payment_status']
-        
-        for product in order_to_edit.products:
-            db.session.delete(product)
-        
-        product_names = form.getlist('product_name')
-        product_quantities = form.getlist('product_quantity')
-        product_prices = form.getlist('product_price')
-        
-        for name, quantity, price in zip(product_names, product_quantities, product_prices):
-            if name and quantity and price:
-                db.session.add(Product(
-                    description=name, 
-                    quantity=int(quantity), 
-                    price=float(price), 
-                    order=order_to_edit
-                ))
+@login_required
+def edit_order(order_id):
+    order_to_edit = Order.query.get_or_404(order_id)
+    if request.method == 'POST':
+        form = request.form
+        previous_rollup = order_rollup_values(order_to_edit)
+        order_to_edit.customer_name = form['customer_name']
+        order_to_edit.customer_phone = form['customer_phone']
+        order_to_edit.destination_city = form['destination_city']
+        order_to_edit.shipping_cost = float(form['shipping_cost'])
+        order_to_edit.order_status = form['order_status']
+        order_to_edit.payment_status = form['payment_status']
         
+        products = sync_order_products(order_to_edit, form)
+        order_to_edit.refresh_costs(products)
+        current_rollup = order_rollup_values(order_to_edit)
+        if current_rollup != previous_rollup:
+            apply_stats_rollup_deltas([
+                rollup_delta(values, sign) for values, sign in ((previous_rollup, -1), (current_rollup, 1)) if values
+            ])
         db.session.commit()
+        invalidate_order_count_cache()
         flash('تم تحديث الطلب بنجاح!', 'success')
         return redirect(url_for('dashboard'))
     return render_template("order_form.html", order=order_to_edit)
@@ -1218,46 +2184,681 @@ def edit_order(order_id):
 @login_required
 def delete_order(order_id):
     order_to_delete = Order.query.get_or_404(order_id)
+    update_stats_rollup(order_rollup_values(order_to_delete), -1)
     db.session.delete(order_to_delete)
     db.session.commit()
+    invalidate_order_count_cache()
     flash('تم حذف الطلب بنجاح.', 'danger')
     return redirect(url_for('dashboard'))
 
+# --- استيراد الطلبات من ملف CSV (Streaming Bulk Import) ---
+ORDER_STATUSES = ('جديد', 'تم الشراء', 'في الطريق', 'تم التسليم')
+PAYMENT_STATUSES = ('لم يتم الدفع', 'تم الدفع')
+ORDER_IMPORT_REQUIRED_COLUMNS = (
+    'order_key', 'customer_name', 'customer_phone', 'destination_city',
+    'product_description', 'product_quantity', 'product_price',
+)
+ORDER_IMPORT_OPTIONAL_COLUMNS = ('shipping_cost', 'order_status', 'payment_status', 'created_at')
+
+def parse_import_row(row):
+    # يعيد (بيانات الطلب، بيانات المنتج) أو يرفع ValueError برسالة تُعرض للمستخدم
+    row = {key: (value or '').strip() for key, value in row.items() if key}
+    missing = [column for column in ORDER_IMPORT_REQUIRED_COLUMNS if not row.get(column)]
+    if missing:
+        raise ValueError(f"حقول مطلوبة فارغة: {', '.join(missing)}")
+    order_status = row.get('order_status') or 'جديد'
+    payment_status = row.get('payment_status') or 'لم يتم الدفع'
+    if order_status not in ORDER_STATUSES:
+        raise ValueError(f'حالة طلب غير معروفة: {order_status}')
+    if payment_status not in PAYMENT_STATUSES:
+        raise ValueError(f'حالة دفع غير معروفة: {payment_status}')
+    try:
+        shipping_cost = float(row.get('shipping_cost') or 0)
+        quantity = int(row['product_quantity'])
+        price = float(row['product_price'])
+    except ValueError:
+        raise ValueError('قيمة رقمية غير صالحة في تكلفة الشحن أو الكمية أو السعر')
+    if shipping_cost < 0 or quantity < 1 or price < 0:
+        raise ValueError('الكمية يجب أن تكون 1 على الأقل، والأسعار لا تكون سالبة')
+    try:
+        created_at = datetime.fromisoformat(row['created_at']) if row.get('created_at') else None
+    except ValueError:
+        raise ValueError(f"تاريخ غير صالح: {row['created_at']} (الصيغة YYYY-MM-DD)")
+    order_fields = {
+        'customer_name': row['customer_name'],
+        'customer_phone': row['customer_phone'],
+        'destination_city': row['destination_city'],
+        'shipping_cost': shipping_cost,
+        'order_status': order_status,
+        'payment_status': payment_status,
+        'created_at': created_at,
+    }
+    return order_fields, {'description': row['product_description'], 'quantity': quantity, 'price': price}
+
+def insert_import_batch(groups):
+    # دفعة واحدة = معاملة واحدة: الطلبات بـ executemany مع RETURNING، ثم المنتجات، ثم فهرس البحث والملخص
+    now = datetime.utcnow()
+    order_rows = []
+    for group in groups:
+        phone_digits = normalize_phone(group['order']['customer_phone'])
+        products_cost = sum(product['quantity'] * product['price'] for product in group['products'])
+        order_rows.append({
+            **group['order'],
+            'created_at': group['order']['created_at'] or now,
+            'products_cost': products_cost,
+            'total_cost': products_cost + group['order']['shipping_cost'],
+            'phone_digits': phone_digits,
+            'phone_reversed': phone_digits[::-1],
+        })
+    order_ids = db.session.scalars(
+        insert(Order).returning(Order.id, sort_by_parameter_order=True), order_rows
+    ).all()
+    product_rows = [
+        {**product, 'order_id': order_id}
+        for order_id, group in zip(order_ids, groups) for product in group['products']
+    ]
+    db.session.execute(insert(Product), product_rows)
+    refresh_order_search(db.session.connection(), order_ids)
+    rollup = {}
+    for row in order_rows:
+        key = (row['created_at'].date(), row['destination_city'], row['order_status'], row['payment_status'])
+        count, products_revenue, shipping_revenue = rollup.get(key, (0, 0.0, 0.0))
+        rollup[key] = (count + 1, products_revenue + row['products_cost'], shipping_revenue + row['shipping_cost'])
+    apply_stats_rollup_deltas([
+        rollup_delta({
+            'day': day, 'destination_city': city, 'order_status': order_status, 'payment_status': payment_status,
+            'products_revenue': products_revenue, 'shipping_revenue': shipping_revenue,
+        }, 1, count)
+        for (day, city, order_status, payment_status), (count, products_revenue, shipping_revenue) in rollup.items()
+    ])
+    db.session.commit()
+    return len(order_rows), len(product_rows)
+
+def import_orders_csv(stream):
+    # قراءة متدفقة: لا يبقى في الذاكرة إلا دفعة واحدة من الطلبات ومفاتيح الطلبات التي تم استيرادها
+    batch_size = app.config['IMPORT_BATCH_ORDERS']
+    max_errors = app.config['IMPORT_MAX_REPORTED_ERRORS']
+    result = {'rows': 0, 'orders': 0, 'products': 0, 'failed_orders': 0, 'errors': [], 'error_count': 0}
+
+    def report(line, order_key, message):
+        result['error_count'] += 1
+        if len(result['errors']) < max_errors:
+            result['errors'].append({'line': line, 'order_key': order_key, 'message': message})
+
+    def flush(pending):
+        groups = [group for group in pending.values() if not group['failed']]
+        result['failed_orders'] += len(pending) - len(groups)
+        if not groups:
+            return
+        try:
+            orders, products = insert_import_batch(groups)
+            result['orders'] += orders
+            result['products'] += products
+        except Exception as e:
+            db.session.rollback()
+            result['failed_orders'] += len(groups)
+            report(groups[0]['line'], groups[0]['key'], f'فشل حفظ دفعة من {len(groups)} طلب: {e}')
+
+    reader = csv.DictReader(stream)
+    missing_columns = [column for column in ORDER_IMPORT_REQUIRED_COLUMNS if column not in (reader.fieldnames or ())]
+    if missing_columns:
+        raise ValueError(f"أعمدة مفقودة في الملف: {', '.join(missing_columns)}")
+    pending, imported_keys = {}, set()
+    try:
+        for line, row in enumerate(reader, start=2):
+            result['rows'] += 1
+            order_key = (row.get('order_key') or '').strip()
+            group = pending.get(order_key)
+            if group is None:
+                if order_key in imported_keys:
+                    report(line, order_key, 'أسطر هذا الطلب غير متتالية، وقد تم حفظ الجزء الأول منه في دفعة سابقة')
+                    continue
+                # الطلب السابق اكتمل، فيمكن حفظ الدفعة قبل بدء طلب جديد
+                if len(pending) >= batch_size:
+                    flush(pending)
+                    imported_keys.update(pending)
+                    pending = {}
+                group = pending[order_key] = {'key': order_key, 'line': line, 'order': None, 'products': [], 'failed': False}
+            try:
+                order_fields, product = parse_import_row(row)
+            except ValueError as e:
+                group['failed'] = True
+                report(line, order_key, str(e))
+                continue
+            if group['order'] is None:
+                group['order'] = order_fields
+            group['products'].append(product)
+    except (UnicodeDecodeError, csv.Error) as e:
+        report(result['rows'] + 2, '', f'تعذرت قراءة بقية الملف (يجب أن يكون CSV بترميز UTF-8): {e}')
+    flush(pending)
+    if result['orders']:
+        invalidate_order_count_cache()
+    return result
+
+@app.route('/orders/import', methods=['GET', 'POST'])
+@login_required
+def import_orders():
+    result = None
+    if request.method == 'POST':
+        file = request.files.get('orders_file')
+        if not file or not file.filename:
+            flash('لم يتم اختيار أي ملف.', 'warning')
+            return redirect(url_for('import_orders'))
+        try:
+            result = import_orders_csv(io.TextIOWrapper(file.stream, encoding='utf-8-sig', newline=''))
+            flash(f"تم استيراد {result['orders']} طلب بنجاح.", 'success' if not result['error_count'] else 'warning')
+        except ValueError as e:
+            flash(f'لا يمكن استيراد الملف: {e}', 'danger')
+    return render_template(
+        'import_orders.html',
+        result=result,
+        required_columns=ORDER_IMPORT_REQUIRED_COLUMNS,
+        optional_columns=ORDER_IMPORT_OPTIONAL_COLUMNS
+    )
+
+@app.cli.command('import-orders')
+@click.argument('csv_path', type=click.Path(exists=True, dir_okay=False))
+def import_orders_command(csv_path):
+    started = time.perf_counter()
+    with open(csv_path, encoding='utf-8-sig', newline='') as f:
+        try:
+            result = import_orders_csv(f)
+        except ValueError as e:
+            raise SystemExit(f"Cannot import {csv_path}: {e}")
+    print(f"Imported {result['orders']} orders ({result['products']} products) from {result['rows']} rows "
+          f"in {time.perf_counter() - started:.1f} s; {result['failed_orders']} orders rejected.")
+    for error in result['errors']:
+        print(f"  line {error['line']} [{error['order_key']}]: {error['message']}")
+    if result['error_count'] > len(result['errors']):
+        print(f"  ... and {result['error_count'] - len(result['errors'])} more errors")
+
+# --- تصدير الطلبات (CSV / JSON Lines متدفق) ---
+# أعمدة CSV تطابق ملف الاستيراد، فيمكن إعادة استيراد الملف المصدَّر كما هو
+ORDER_EXPORT_COLUMNS = (
+    'order_key', 'customer_name', 'customer_phone', 'destination_city', 'shipping_cost',
+    'order_status', 'payment_status', 'created_at',
+    'product_description', 'product_quantity', 'product_price', 'products_cost', 'total_cost',
+)
+ORDER_EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+def iter_export_orders(filters):
+    # yield_per يجلب الطلبات من المؤشر على دفعات، و selectinload يحمّل منتجات كل دفعة باستعلام واحد
+    return apply_order_filters(Order.query.options(selectinload(Order.products)), filters) \
+        .order_by(Order.created_at.desc(), Order.id.desc()) \
+        .yield_per(app.config['EXPORT_BATCH_SIZE'])
+
+def order_export_record(order):
+    return {
+        'order_id': order.id,
+        'customer_name': order.customer_name,
+        'customer_phone': order.customer_phone,
+        'destination_city': order.destination_city,
+        'shipping_cost': order.shipping_cost,
+        'order_status': order.order_status,
+        'payment_status': order.payment_status,
+        'created_at': order.created_at.isoformat(timespec='seconds'),
+        'products_cost': order.products_cost,
+        'total_cost': order.total_cost,
+        'products': [
+            {'description': product.description, 'quantity': product.quantity, 'price': product.price}
+            for product in order.products
+        ],
+    }
+
+def stream_orders_csv(orders):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(ORDER_EXPORT_COLUMNS)
+    # BOM حتى يفتح Excel النص العربي بالترميز الصحيح؛ السطر الأول يُرسل قبل تنفيذ الاستعلام
+    yield ('\ufeff' + buffer.getvalue()).encode('utf-8')
+    buffer.seek(0)
+    buffer.truncate()
+    for count, order in enumerate(orders, start=1):
+        order_fields = [
+            order.id, order.customer_name, order.customer_phone, order.destination_city, order.shipping_cost,
+            order.order_status, order.payment_status, order.created_at.isoformat(timespec='seconds'),
+        ]
+        for product in order.products or [None]:
+            product_fields = [product.description, product.quantity, product.price] if product else ['', '', '']
+            writer.writerow(order_fields + product_fields + [order.products_cost, order.total_cost])
+        if count % 100 == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+def stream_orders_jsonl(orders):
+    lines = []
+    for order in orders:
+        lines.append(json.dumps(order_export_record(order), ensure_ascii=False))
+        if len(lines) == 100:
+            yield ('\n'.join(lines) + '\n').encode('utf-8')
+            lines = []
+    if lines:
+        yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+@app.route('/orders/export')
+@login_required
+def export_orders():
+    filters = get_order_filters(request.args)
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ORDER_EXPORT_FORMATS:
+        flash('صيغة التصدير غير مدعومة.', 'warning')
+        return redirect(url_for('dashboard', **filters))
+    orders = iter_export_orders(filters)
+    stream = stream_orders_csv(orders) if export_format == 'csv' else stream_orders_jsonl(orders)
+    return Response(
+        stream_with_context(stream),
+        mimetype=ORDER_EXPORT_FORMATS[export_format],
+        headers=attachment_headers(f"طلبات-{datetime.now().strftime('%Y-%m-%d')}.{export_format}")
+    )
+
+# --- تغيير حالة الطلبات بالجملة (Set-Based UPDATE) ---
+def bulk_update_order_status(order_ids, order_status=None, payment_status=None):
+    # عبارة UPDATE واحدة لكل دفعة من المعرفات، مع نقل مجاميع الملخص من المفاتيح القديمة إلى الجديدة
+    changes = {key: value for key, value in (('order_status', order_status), ('payment_status', payment_status)) if value}
+    if not changes:
+        return 0
+    chunk_size = app.config['BULK_STATUS_CHUNK_SIZE']
+    updated = 0
+    for start in range(0, len(order_ids), chunk_size):
+        chunk = order_ids[start:start + chunk_size]
+        # الطلبات التي لها الحالة المطلوبة أصلاً لا تُحتسب ولا تُلمس
+        condition = and_(Order.id.in_(chunk), or_(*(getattr(Order, key) != value for key, value in changes.items())))
+        groups = db.session.query(
+            func.date(Order.created_at), Order.destination_city, Order.order_status, Order.payment_status,
+            func.count(Order.id), func.coalesce(func.sum(Order.products_cost), 0.0),
+            func.coalesce(func.sum(Order.shipping_cost), 0.0)
+        ).filter(condition, Order.created_at.is_not(None)).group_by(
+            func.date(Order.created_at), Order.destination_city, Order.order_status, Order.payment_status
+        ).all()
+        deltas = []
+        for day, city, current_order_status, current_payment_status, count, products_revenue, shipping_revenue in groups:
+            values = {
+                'day': date.fromisoformat(day), 'destination_city': city,
+                'order_status': current_order_status, 'payment_status': current_payment_status,
+                'products_revenue': products_revenue, 'shipping_revenue': shipping_revenue,
+            }
+            deltas.append(rollup_delta(values, -1, count))
+            deltas.append(rollup_delta({**values, **changes}, 1, count))
+        changed_ids = db.session.scalars(
+            update(Order).where(condition)
+            .values(**changes, version=Order.version + 1, updated_at=datetime.utcnow())
+            .returning(Order.id)
+            .execution_options(synchronize_session=False)
+        ).all()
+        if deltas:
+            apply_stats_rollup_deltas(deltas)
+        # الفواتير المخزنة تعرض الحالة، فتُحذف بعد commit عبر purge_changed_invoices
+        db.session.info.setdefault('changed_order_ids', set()).update(changed_ids)
+        db.session.commit()
+        updated += len(changed_ids)
+    if updated:
+        invalidate_order_count_cache()
+    return updated
+
+def validate_status_changes(order_status, payment_status):
+    if not order_status and not payment_status:
+        raise ValueError('اختر حالة الطلب أو حالة الدفع الجديدة.')
+    if order_status and order_status not in ORDER_STATUSES:
+        raise ValueError(f'حالة طلب غير معروفة: {order_status}')
+    if payment_status and payment_status not in PAYMENT_STATUSES:
+        raise ValueError(f'حالة دفع غير معروفة: {payment_status}')
+
+def strict_order_filters(values):
+    # لعمليات الكتابة بالجملة: مفتاح أو قيمة غير مفهومة ترفض الطلب بدلاً من أن تُحذف بصمت
+    # كما يفعل get_order_filters للعرض، فيتسع النطاق إلى كل الطلبات
+    unknown = [str(key) for key in values if key not in ORDER_FILTER_KEYS]
+    if unknown:
+        raise ValueError(f"unknown filter keys: {', '.join(unknown)}")
+    filters = {}
+    for key, value in values.items():
+        if not isinstance(value, str) or not value.strip():
+            raise ValueError(f'filter {key} must be a non-empty string')
+        filters[key] = value.strip()
+    for key in ('date_from', 'date_to'):
+        if key in filters:
+            try:
+                date.fromisoformat(filters[key])
+            except ValueError:
+                raise ValueError(f'filter {key} must be YYYY-MM-DD')
+    if filters.get('order_status', ORDER_STATUSES[0]) not in ORDER_STATUSES:
+        raise ValueError(f"filter order_status must be one of {list(ORDER_STATUSES)}")
+    if filters.get('payment_status', PAYMENT_STATUSES[0]) not in PAYMENT_STATUSES:
+        raise ValueError(f"filter payment_status must be one of {list(PAYMENT_STATUSES)}")
+    search_term = filters.get('search_term')
+    if search_term and not get_search_digits(search_term) and not build_fts_query(search_term):
+        raise ValueError('filter search_term has nothing to search for')
+    return filters
+
+def form_order_ids(values):
+    # قيم غير رقمية أو خارج مدى SQLite لا يمكن أن تطابق طلباً فتُتجاهل
+    return sorted({int(value) for value in values if re.fullmatch(r'\d{1,19}', value) and fits_sqlite_integer(int(value))})
+
+def filtered_order_ids(filters):
+    return [row[0] for row in apply_order_filters(db.session.query(Order.id), filters).order_by(Order.id)]
+
+@app.route('/orders/bulk-status', methods=['POST'])
+@login_required
+def bulk_update_status():
+    filters = get_order_filters(request.form)
+    order_status = request.form.get('new_order_status', '')
+    payment_status = request.form.get('new_payment_status', '')
+    try:
+        validate_status_changes(order_status, payment_status)
+    except ValueError as e:
+        flash(str(e), 'warning')
+        return redirect(url_for('dashboard', **filters))
+    if request.form.get('apply_to_filter') == '1':
+        try:
+            strict_filters = strict_order_filters(
+                {key: request.form[key] for key in ORDER_FILTER_KEYS if request.form.get(key, '').strip()}
+            )
+        except ValueError as e:
+            flash(f'الفلترة غير صالحة ولم يتم تغيير أي طلب: {e}', 'danger')
+            return redirect(url_for('dashboard', **filters))
+        if not strict_filters and request.form.get('confirm_all') != '1':
+            flash('لا توجد فلترة، وهذا سيغير كل الطلبات. أكّد ذلك بتحديد خانة التأكيد أولاً.', 'warning')
+            return redirect(url_for('dashboard'))
+        order_ids = filtered_order_ids(strict_filters)
+    else:
+        order_ids = form_order_ids(request.form.getlist('order_ids'))
+    if not order_ids:
+        flash('لم يتم تحديد أي طلب.', 'warning')
+        return redirect(url_for('dashboard', **filters))
+    updated = bulk_update_order_status(order_ids, order_status, payment_status)
+    flash(f'تم تغيير حالة {updated} طلب (من أصل {len(order_ids)} محدد).', 'success')
+    return redirect(url_for('dashboard', **filters))
+
 @app.route('/statistics')
 @login_required
 def statistics():
-    paid_orders = Order.query.filter_by(payment_status='تم الدفع').all()
-    total_revenue = sum(order.total_cost for order in paid_orders)
-    total_orders = Order.query.count()
-    completed_orders = Order.query.filter_by(order_status='تم التسليم').count()
-    average_order_value = total_revenue / len(paid_orders) if paid_orders else 0
+    date_from = request.args.get('date_from', '')
+    date_to = request.args.get('date_to', '')
+    try:
+        stats = compute_order_stats(date_from, date_to)
+    except ValueError:
+        flash('صيغة التاريخ غير صحيحة.', 'warning')
+        stats = compute_order_stats('', '')
+    return render_template('statistics.html', stats=stats, date_from=date_from, date_to=date_to)
+
+def compute_order_stats(date_from, date_to):
+    # الإحصائيات تُقرأ من جدول الملخص بدلاً من مسح كل الطلبات؛ التاريخ غير الصالح يرفع ValueError
+    filters = []
+    if date_from:
+        filters.append(OrderStatsRollup.day >= date.fromisoformat(date_from))
+    if date_to:
+        filters.append(OrderStatsRollup.day <= date.fromisoformat(date_to))
+
+    is_paid = OrderStatsRollup.payment_status == 'تم الدفع'
+    total_orders, total_revenue, paid_orders, completed_orders = db.session.query(
+        func.coalesce(func.sum(OrderStatsRollup.order_count), 0),
+        func.coalesce(func.sum(case(
+            (is_paid, OrderStatsRollup.products_revenue + OrderStatsRollup.shipping_revenue), else_=0.0
+        )), 0.0),
+        func.coalesce(func.sum(case((is_paid, OrderStatsRollup.order_count), else_=0)), 0),
+        func.coalesce(func.sum(case(
+            (OrderStatsRollup.order_status == 'تم التسليم', OrderStatsRollup.order_count), else_=0
+        )), 0)
+    ).filter(*filters).one()
+    average_order_value = total_revenue / paid_orders if paid_orders else 0
+    city_count = func.sum(OrderStatsRollup.order_count)
     top_cities_query = db.session.query(
-        Order.destination_city, 
-        func.count(Order.id).label('city_count')
-    ).group_by(Order.destination_city).order_by(func.count(Order.id).desc()).limit(5).all()
+        OrderStatsRollup.destination_city,
+        city_count.label('city_count')
+    ).filter(*filters).group_by(OrderStatsRollup.destination_city) \
+        .having(city_count > 0).order_by(city_count.desc()).limit(5).all()
     
-    stats = {
+    return {
         'total_revenue': total_revenue,
         'total_orders': total_orders,
         'completed_orders': completed_orders,
         'average_order_value': average_order_value,
         'top_cities': top_cities_query
     }
-    return render_template('statistics.html', stats=stats)
 
-def ensure_cairo_font():
-    static_dir = Path(app.static_folder)
-    cairo_font_path = static_dir / 'Cairo-Regular.ttf'
-    
-    if not cairo_font_path.exists():
+@app.cli.command('fetch-invoice-fonts')
+def fetch_invoice_fonts_command():
+    # التحميل من الشبكة يتم فقط عند تشغيل هذا الأمر، وليس أثناء طلبات المستخدمين
+    for _, _, filename in INVOICE_FONTS:
+        font_path = os.path.join(STATIC_DIR, filename)
+        if os.path.exists(font_path):
+            continue
         try:
-            cairo_font_url = "https://github.com/google/fonts/raw/main/ofl/cairo/Cairo-Regular.ttf"
-            response = requests.get(cairo_font_url)
-            with open(cairo_font_path, 'wb') as f:
+            import requests
+            response = requests.get(f"https://github.com/google/fonts/raw/main/ofl/cairo/{filename}", timeout=30)
+            response.raise_for_status()
+            with open(font_path, 'wb') as f:
                 f.write(response.content)
-            print("تم تحميل خط Cairo بنجاح")
+            print(f"تم تحميل الخط {filename} بنجاح")
         except Exception as e:
-            print(f"خطأ في تحميل الخط: {e}")
+            print(f"خطأ في تحميل الخط {filename}: {e}")
+    missing = invoice_asset_preflight()
+    print("All invoice assets present." if not missing else f"Still missing: {', '.join(missing)}")
+
+# --- ذاكرة تخزين ملفات PDF للفواتير (Invoice PDF Cache) ---
+# الملف يُسمى order-<id>-<sha256 لقالب HTML>.pdf، فأي تغيير في الطلب ينتج مفتاحاً جديداً
+invoice_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+def invoice_cache_path(order_id, rendered_html):
+    # ملف الأنماط جزء من المفتاح لأنه لم يعد داخل HTML
+    digest = hashlib.sha256((INVOICE_CSS_DIGEST + invoice_font_css() + rendered_html).encode('utf-8')).hexdigest()
+    return os.path.join(invoice_cache_dir(), f'order-{order_id}-{digest}.pdf')
+
+def read_cached_invoice(path):
+    try:
+        with open(path, 'rb') as f:
+            pdf_file = f.read()
+    except FileNotFoundError:
+        invoice_cache_stats['misses'] += 1
+        return None
+    # وقت التعديل يُستخدم كوقت آخر استخدام لسياسة LRU
+    os.utime(path)
+    invoice_cache_stats['hits'] += 1
+    return pdf_file
+
+def store_cached_invoice(path, pdf_file):
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(pdf_file)
+    os.replace(temp_path, path)
+    evict_invoice_cache()
+
+def evict_invoice_cache():
+    entries = []
+    total_size = 0
+    with os.scandir(invoice_cache_dir()) as it:
+        for entry in it:
+            if entry.name.endswith('.pdf'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total_size += stat.st_size
+    entries.sort()
+    for _, size, path in entries:
+        if total_size <= app.config['INVOICE_CACHE_MAX_BYTES']:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_size -= size
+        invoice_cache_stats['evictions'] += 1
+
+def invalidate_invoice_caches(order_ids):
+    # مرور واحد على المجلد مهما كان عدد الطلبات (التحديث بالجملة قد يغيّر آلاف الطلبات)
+    order_ids = {str(order_id) for order_id in order_ids}
+    with os.scandir(invoice_cache_dir()) as it:
+        for entry in it:
+            if entry.name.startswith('order-') and entry.name.split('-', 2)[1] in order_ids:
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+def clear_invoice_cache():
+    with os.scandir(invoice_cache_dir()) as it:
+        for entry in it:
+            if entry.name.endswith(('.pdf', '.pending', '.failed')):
+                os.remove(entry.path)
+
+# --- إنشاء ملفات PDF في مجموعة عمليات منفصلة (Invoice Render Pool) ---
+# WeasyPrint يعمل خارج عملية الطلب؛ عدد المهام المعلقة محدود بعدد العمال + عمق الطابور
+class InvoiceQueueFull(Exception):
+    pass
+
+_invoice_pool = None
+_invoice_slots = None
+_invoice_pool_lock = threading.Lock()
+invoice_jobs = {}
+
+_invoice_renderer = {}
+
+def init_invoice_renderer():
+    # يُنفذ مرة واحدة في كل عملية: إعداد الخطوط وملف الأنماط المترجم يُعاد استخدامهما لكل فاتورة
+    # استيراد WeasyPrint مؤجل إلى أول فاتورة لأنه أثقل جزء في بدء تشغيل التطبيق
+    # عمال spawn (Windows / waitress) لا يرثون ذاكرة العملية الأم، فيُحمّلون الشعار والخطوط بأنفسهم
+    if not invoice_assets:
+        load_invoice_assets()
+    from weasyprint import CSS
+    from weasyprint.text.fonts import FontConfiguration
+    font_config = FontConfiguration()
+    _invoice_renderer['font_config'] = font_config
+    _invoice_renderer['stylesheets'] = [CSS(
+        string=invoice_font_css() + INVOICE_CSS, font_config=font_config, url_fetcher=invoice_url_fetcher
+    )]
+
+def get_invoice_renderer():
+    if not _invoice_renderer:
+        init_invoice_renderer()
+    return _invoice_renderer
+
+def write_invoice_pdf(rendered_html):
+    from weasyprint import HTML
+    renderer = get_invoice_renderer()
+    return HTML(string=rendered_html, url_fetcher=invoice_url_fetcher).write_pdf(
+        stylesheets=renderer['stylesheets'], font_config=renderer['font_config']
+    )
+
+def get_invoice_pool():
+    global _invoice_pool, _invoice_slots
+    with _invoice_pool_lock:
+        if _invoice_pool is None:
+            workers = app.config['INVOICE_RENDER_WORKERS']
+            _invoice_pool = ProcessPoolExecutor(max_workers=workers, initializer=init_invoice_renderer)
+            _invoice_slots = threading.BoundedSemaphore(workers + app.config['INVOICE_RENDER_QUEUE_DEPTH'])
+    return _invoice_pool
+
+def write_merged_invoice_pdf(rendered_html_list):
+    # كل الفواتير في مستند WeasyPrint واحد متعدد الصفحات
+    from weasyprint import HTML
+    renderer = get_invoice_renderer()
+    documents = [
+        HTML(string=rendered_html, url_fetcher=invoice_url_fetcher).render(
+            stylesheets=renderer['stylesheets'], font_config=renderer['font_config']
+        )
+        for rendered_html in rendered_html_list
+    ]
+    pages = [page for document in documents for page in document.pages]
+    return documents[0].copy(pages).write_pdf()
+
+def submit_to_invoice_pool(fn, *args, wait=None):
+    # wait = None: رفض فوري عند امتلاء الطابور، وإلا الانتظار حتى wait ثانية لمكان شاغر
+    pool = get_invoice_pool()
+    acquired = _invoice_slots.acquire(timeout=wait) if wait else _invoice_slots.acquire(blocking=False)
+    if not acquired:
+        raise InvoiceQueueFull()
+    try:
+        future = pool.submit(fn, *args)
+    except Exception:
+        _invoice_slots.release()
+        raise
+    future.add_done_callback(lambda f: _invoice_slots.release())
+    return future
+
+def invoice_job_id(path):
+    return os.path.basename(path)[:-len('.pdf')]
+
+# حالة المهمة تُحفظ بجانب ملف PDF (order-<id>-<sha>.pending / .failed) حتى يجيب عنها أي عامل،
+# وليس فقط العامل الذي أرسل المهمة إلى مجموعة العمليات
+def invoice_job_marker(path, state):
+    return f'{path[:-len(".pdf")]}.{state}'
+
+def write_invoice_job_marker(path, state, text=''):
+    marker_path = invoice_job_marker(path, state)
+    temp_path = f'{marker_path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(temp_path, marker_path)
+
+def remove_invoice_job_marker(path, state):
+    try:
+        os.remove(invoice_job_marker(path, state))
+    except FileNotFoundError:
+        pass
+
+def finish_invoice_job(future, path):
+    if future.exception() is None:
+        store_cached_invoice(path, future.result())
+    else:
+        write_invoice_job_marker(path, 'failed', str(future.exception()))
+    remove_invoice_job_marker(path, 'pending')
+    invoice_jobs.pop(invoice_job_id(path), None)
+
+def submit_invoice_render(order_id, rendered_html, wait=None):
+    path = invoice_cache_path(order_id, rendered_html)
+    job_id = invoice_job_id(path)
+    future = invoice_jobs.get(job_id)
+    if future is not None and not future.done():
+        return job_id, future
+    remove_invoice_job_marker(path, 'failed')
+    write_invoice_job_marker(path, 'pending', str(os.getpid()))
+    try:
+        future = submit_to_invoice_pool(write_invoice_pdf, rendered_html, wait=wait)
+    except Exception:
+        remove_invoice_job_marker(path, 'pending')
+        raise
+    invoice_jobs[job_id] = future
+    future.add_done_callback(lambda f: finish_invoice_job(f, path))
+    return job_id, future
+
+def render_invoice_pdf(order_id, rendered_html):
+    path = invoice_cache_path(order_id, rendered_html)
+    pdf_file = read_cached_invoice(path)
+    if pdf_file is None:
+        timeout = app.config['INVOICE_RENDER_TIMEOUT']
+        _, future = submit_invoice_render(order_id, rendered_html, wait=timeout)
+        pdf_file = future.result(timeout=timeout)
+    return pdf_file
+
+def render_invoice_html(order, embed_styles=False):
+    # الشعار والخطوط تُطلب عبر asset: ويقدمها invoice_url_fetcher من الذاكرة
+    return render_template(
+        'invoice_pdf_template.html', 
+        order=order, 
+        logo_path=invoice_asset_url('logo.png'),
+        embed_styles=embed_styles,
+        invoice_css=invoice_font_css() + INVOICE_CSS
+    )
+
+def invoice_filename(order):
+    customer_name_formatted = order.customer_name.replace(' ', '_').replace('/', '_')
+    invoice_date = order.created_at.strftime('%Y-%m-%d')
+    return f"فاتورة-{customer_name_formatted}-{invoice_date}.pdf"
+
+def attachment_headers(filename):
+    return {'Content-Disposition': f"attachment; filename*=UTF-8''{quote(filename)}"}
+
+def invoice_pdf_response(order, pdf_file):
+    filename = invoice_filename(order)
+    
+    response = make_response(pdf_file)
+    response.headers['Content-Type'] = 'application/pdf'
+    response.headers.update(attachment_headers(filename))
+    return response
 
 @app.route('/invoice/preview/<int:order_id>')
 @login_required
@@ -1268,79 +2869,918 @@ def preview_invoice(order_id):
         'invoice_pdf_template.html', 
         order=order, 
         logo_path=url_for('static', filename='logo.png'),
-        cairo_regular_path=url_for('static', filename='Cairo-Regular.ttf')
+        embed_styles=True,
+        invoice_css=invoice_font_css(url_for('static', filename='')) + INVOICE_CSS
     )
 
 @app.route('/invoice/download/<int:order_id>')
 @login_required
 def download_invoice_pdf(order_id):
     order = Order.query.get_or_404(order_id)
-    
-    # التأكد من وجود ملف الخطوط
-    ensure_cairo_font()
-    
-    # استخدام مسارات مطلقة للخطوط والصور
-    static_dir = Path(app.static_folder)
-    logo_path = static_dir / 'logo.png'
-    cairo_font_path = static_dir / 'Cairo-Regular.ttf'
-    
-    # استخدام مسارات ملفات محلية بدلاً من URIs
-    logo_uri = logo_path.as_uri() if logo_path.exists() else ""
-    cairo_regular_uri = cairo_font_path.as_uri() if cairo_font_path.exists() else ""
-    
-    rendered_html = render_template(
-        'invoice_pdf_template.html', 
-        order=order, 
-        logo_path=logo_uri,
-        cairo_regular_path=cairo_regular_uri
-    )
+    rendered_html = render_invoice_html(order)
     
     try:
-        # إعداد خيارات PDF للغة العربية
-        html = HTML(string=rendered_html)
-        pdf_file = html.write_pdf()
-        
-        customer_name_formatted = order.customer_name.replace(' ', '_')
-        invoice_date = order.created_at.strftime('%Y-%m-%d')
-        filename = f"فاتورة-{customer_name_formatted}-{invoice_date}.pdf"
-        
-        response = make_response(pdf_file)
-        response.headers['Content-Type'] = 'application/pdf'
-        
-        encoded_filename = quote(filename)
-        response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{encoded_filename}"
-        
-        return response
+        pdf_file = render_invoice_pdf(order.id, rendered_html)
+        return invoice_pdf_response(order, pdf_file)
+    except (InvoiceQueueFull, FutureTimeoutError):
+        flash('الخادم مشغول بإنشاء فواتير أخرى، الرجاء المحاولة بعد قليل.', 'warning')
+        return redirect(url_for('dashboard'))
     except Exception as e:
         flash(f'خطأ في إنشاء ملف PDF: {e}', 'danger')
         return redirect(url_for('dashboard'))
 
+@app.cli.command('benchmark-invoice-render')
+@click.option('--count', default=20, show_default=True, help='Number of recent orders to render.')
+def benchmark_invoice_render_command(count):
+    # يقارن الطريقة القديمة (أنماط داخل HTML وخطوط جديدة لكل فاتورة) بملف الأنماط المترجم المشترك
+    orders = Order.query.options(selectinload(Order.products)).order_by(Order.id.desc()).limit(count).all()
+    if not orders:
+        print("No orders to render.")
+        return
+    from weasyprint import HTML
+    inline_html = [render_invoice_html(order, embed_styles=True) for order in orders]
+    shared_html = [render_invoice_html(order) for order in orders]
+
+    started = time.perf_counter()
+    for rendered_html in inline_html:
+        HTML(string=rendered_html, url_fetcher=invoice_url_fetcher).write_pdf()
+    inline_ms = (time.perf_counter() - started) * 1000 / len(orders)
+
+    _invoice_renderer.clear()
+    started = time.perf_counter()
+    init_invoice_renderer()
+    setup_ms = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    for rendered_html in shared_html:
+        write_invoice_pdf(rendered_html)
+    shared_ms = (time.perf_counter() - started) * 1000 / len(orders)
+
+    print(f"Rendered {len(orders)} invoices.")
+    print(f"  inline <style>, fresh fonts : {inline_ms:8.1f} ms/invoice")
+    print(f"  compiled CSS, shared fonts  : {shared_ms:8.1f} ms/invoice (+{setup_ms:.1f} ms one-time setup)")
+
+@app.cli.command('benchmark-template-render')
+@click.option('--rows', default=1000, show_default=True, help='Number of orders in the rendered dashboard.')
+@click.option('--repeat', default=20, show_default=True, help='Number of timed renders.')
+def benchmark_template_render_command(rows, repeat):
+    # طلبات وهمية في الذاكرة حتى لا يعتمد القياس على محتوى قاعدة البيانات
+    created_at = datetime(2025, 1, 1)
+    orders = [
+        Order(id=i, customer_name=f'عميل {i}', customer_phone=f'0912{i:06d}', destination_city='الخرطوم',
+              shipping_cost=10.0, products_cost=45.5, total_cost=55.5, order_status=ORDER_STATUSES[i % len(ORDER_STATUSES)],
+              payment_status=PAYMENT_STATUSES[i % len(PAYMENT_STATUSES)], created_at=created_at + timedelta(minutes=i))
+        for i in range(rows, 0, -1)
+    ]
+    template_names = ('layout.html', 'dashboard.html')
+
+    def compile_ms(env):
+        started = time.perf_counter()
+        for name in template_names:
+            env.get_template(name)
+        return (time.perf_counter() - started) * 1000
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        source_ms = compile_ms(app.jinja_env.overlay(cache_size=0, bytecode_cache=None))
+        bytecode_cache = FileSystemBytecodeCache(cache_dir)
+        compile_ms(app.jinja_env.overlay(cache_size=0, bytecode_cache=bytecode_cache))
+        bytecode_ms = compile_ms(app.jinja_env.overlay(cache_size=0, bytecode_cache=bytecode_cache))
+
+    with app.test_request_context('/dashboard'):
+        context = dict(orders=orders, next_cursor=None, prev_cursor=None, page_args={}, filters={}, total_orders=rows)
+        html = render_template('dashboard.html', **context)
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            render_template('dashboard.html', **context)
+            timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    print(f"Compile layout.html + dashboard.html from source : {source_ms:8.1f} ms")
+    print(f"Load from bytecode cache                         : {bytecode_ms:8.1f} ms")
+    print(f"Render dashboard.html with {rows} rows            : {timings[len(timings) // 2]:8.1f} ms median, "
+          f"{timings[0]:.1f} ms best ({len(html.encode('utf-8')) / 1024:.0f} KiB, "
+          f"{len(LAYOUT_CSS.encode('utf-8')) / 1024:.1f} KiB of CSS served separately)")
+
+# --- تصدير الفواتير بالجملة (ZIP متدفق أو PDF مدمج) ---
+class ZipStreamBuffer:
+    # وجهة كتابة غير قابلة للتنقل؛ zipfile يكتب عندها واصفات البيانات بعد كل ملف
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+def iter_bulk_invoice_pdfs(order_ids):
+    # الفواتير تُرسل إلى مجموعة العمليات على دفعات بحجم (عدد العمال × 2) مع الحفاظ على الترتيب
+    window = max(1, app.config['INVOICE_RENDER_WORKERS'] * 2)
+    timeout = app.config['INVOICE_RENDER_TIMEOUT']
+    for start in range(0, len(order_ids), window):
+        batch_ids = order_ids[start:start + window]
+        orders = {order.id: order for order in Order.query.options(selectinload(Order.products))
+                  .filter(Order.id.in_(batch_ids))}
+        pending = []
+        for order_id in batch_ids:
+            order = orders.get(order_id)
+            if order is None:
+                continue
+            rendered_html = render_invoice_html(order)
+            pdf_file = read_cached_invoice(invoice_cache_path(order.id, rendered_html))
+            if pdf_file is None:
+                _, pdf_file = submit_invoice_render(order.id, rendered_html, wait=timeout)
+            pending.append((order, pdf_file))
+        for order, pdf_file in pending:
+            yield order, pdf_file if isinstance(pdf_file, bytes) else pdf_file.result(timeout=timeout)
+
+def stream_invoice_zip(order_ids):
+    buffer = ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for order, pdf_file in iter_bulk_invoice_pdfs(order_ids):
+            archive.writestr(f'{order.id}-{invoice_filename(order)}', pdf_file)
+            yield buffer.pop()
+    yield buffer.pop()
+
+@app.route('/invoice/bulk')
+@login_required
+def bulk_invoice_export():
+    filters = get_order_filters(request.args)
+    export_format = request.args.get('format', 'zip')
+    max_orders = app.config['BULK_INVOICE_MAX_ORDERS']
+    order_ids = [row[0] for row in apply_order_filters(db.session.query(Order.id), filters)
+                 .order_by(Order.created_at.desc(), Order.id.desc()).limit(max_orders + 1)]
+    if not order_ids:
+        flash('لا توجد طلبات تطابق معايير البحث.', 'warning')
+        return redirect(url_for('dashboard', **filters))
+    if len(order_ids) > max_orders:
+        flash(f'عدد الطلبات أكبر من الحد المسموح للتصدير ({max_orders}). الرجاء تضييق الفلترة.', 'warning')
+        return redirect(url_for('dashboard', **filters))
+
+    export_name = f"فواتير-{datetime.now().strftime('%Y-%m-%d')}"
+    if export_format == 'pdf':
+        orders = Order.query.options(selectinload(Order.products)).filter(Order.id.in_(order_ids)) \
+            .order_by(Order.created_at.desc(), Order.id.desc()).all()
+        rendered_html_list = [render_invoice_html(order) for order in orders]
+        try:
+            future = submit_to_invoice_pool(
+                write_merged_invoice_pdf, rendered_html_list, wait=app.config['INVOICE_RENDER_TIMEOUT']
+            )
+            pdf_file = future.result(timeout=app.config['BULK_INVOICE_MERGED_TIMEOUT'])
+        except (InvoiceQueueFull, FutureTimeoutError):
+            flash('الخادم مشغول بإنشاء فواتير أخرى، الرجاء المحاولة بعد قليل.', 'warning')
+            return redirect(url_for('dashboard', **filters))
+        return Response(pdf_file, mimetype='application/pdf', headers=attachment_headers(f'{export_name}.pdf'))
+
+    return Response(
+        stream_with_context(stream_invoice_zip(order_ids)),
+        mimetype='application/zip',
+        headers=attachment_headers(f'{export_name}.zip')
+    )
+
+# --- واجهة المهام غير المتزامنة للفواتير (submit => job id => poll => download) ---
+# معرف المهمة هو مفتاح الملف في الذاكرة المؤقتة، فأي عملية تستطيع معرفة اكتمالها
+INVOICE_JOB_ID_RE = re.compile(r'^order-(\d+)-[0-9a-f]{64}$')
+
+@app.route('/invoice/jobs/<int:order_id>', methods=['POST'])
+@login_required
+def submit_invoice_job(order_id):
+    order = Order.query.get_or_404(order_id)
+    rendered_html = render_invoice_html(order)
+    path = invoice_cache_path(order.id, rendered_html)
+    job_id = invoice_job_id(path)
+    if not os.path.exists(path):
+        try:
+            submit_invoice_render(order.id, rendered_html)
+        except InvoiceQueueFull:
+            response = jsonify(error='invoice render queue is full')
+            response.headers['Retry-After'] = '5'
+            return response, 503
+    return jsonify(
+        job_id=job_id,
+        status_url=url_for('invoice_job_status', job_id=job_id),
+        download_url=url_for('download_invoice_job', job_id=job_id)
+    ), 202
+
+@app.route('/invoice/jobs/<job_id>')
+@login_required
+def invoice_job_status(job_id):
+    if not INVOICE_JOB_ID_RE.match(job_id):
+        return jsonify(error='invalid job id'), 404
+    path = os.path.join(invoice_cache_dir(), f'{job_id}.pdf')
+    if os.path.exists(path):
+        return jsonify(job_id=job_id, status='done', download_url=url_for('download_invoice_job', job_id=job_id))
+    try:
+        with open(invoice_job_marker(path, 'failed'), encoding='utf-8') as f:
+            return jsonify(job_id=job_id, status='failed', error=f.read())
+    except FileNotFoundError:
+        pass
+    try:
+        pending_since = os.path.getmtime(invoice_job_marker(path, 'pending'))
+    except FileNotFoundError:
+        return jsonify(error='unknown job'), 404
+    if time.time() - pending_since > app.config['INVOICE_JOB_PENDING_TTL']:
+        return jsonify(job_id=job_id, status='failed', error='render worker stopped before finishing the job')
+    # المهمة قد تكون في عامل آخر؛ حالة running معروفة فقط للعامل الذي أرسلها
+    future = invoice_jobs.get(job_id)
+    return jsonify(job_id=job_id, status='running' if future is not None and future.running() else 'pending')
+
+@app.route('/invoice/jobs/<job_id>/download')
+@login_required
+def download_invoice_job(job_id):
+    match = INVOICE_JOB_ID_RE.match(job_id)
+    if not match:
+        return jsonify(error='invalid job id'), 404
+    order = Order.query.get_or_404(int(match.group(1)))
+    pdf_file = read_cached_invoice(os.path.join(invoice_cache_dir(), f'{job_id}.pdf'))
+    if pdf_file is None:
+        return jsonify(error='job not finished'), 409
+    return invoice_pdf_response(order, pdf_file)
+
+# --- واجهة JSON البرمجية (REST API v1) ---
+# المصادقة بـ JWT: POST /api/v1/auth/token ثم الترويسة Authorization: Bearer <token>
+ORDER_API_FIELDS = {
+    'id': lambda order: order.id,
+    'customer_name': lambda order: order.customer_name,
+    'customer_phone': lambda order: order.customer_phone,
+    'destination_city': lambda order: order.destination_city,
+    'shipping_cost': lambda order: order.shipping_cost,
+    'order_status': lambda order: order.order_status,
+    'payment_status': lambda order: order.payment_status,
+    'products_cost': lambda order: order.products_cost,
+    'total_cost': lambda order: order.total_cost,
+    'created_at': lambda order: order.created_at.isoformat(timespec='seconds'),
+    'updated_at': lambda order: order.updated_at.isoformat(timespec='seconds') if order.updated_at else None,
+    'version': lambda order: order.version,
+}
+ORDER_API_ALL_FIELDS = tuple(ORDER_API_FIELDS) + ('products',)
+
+def api_error(message, status):
+    return jsonify({'error': message}), status
+
+def parse_api_fields(value):
+    # ?fields=id,total_cost,products لاختيار الحقول المطلوبة فقط
+    if not value:
+        return ORDER_API_ALL_FIELDS
+    fields = tuple(dict.fromkeys(field.strip() for field in value.split(',') if field.strip()))
+    unknown = [field for field in fields if field not in ORDER_API_ALL_FIELDS]
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(unknown)}")
+    return fields
+
+def order_api_record(order, fields, products=None):
+    record = {field: ORDER_API_FIELDS[field](order) for field in fields if field != 'products'}
+    if 'products' in fields:
+        record['products'] = [
+            {'id': product.id, 'description': product.description, 'quantity': product.quantity, 'price': product.price}
+            for product in (order.products if products is None else products)
+        ]
+    return record
+
+def load_products_by_order(order_ids):
+    products = {order_id: [] for order_id in order_ids}
+    for product in Product.query.filter(Product.order_id.in_(order_ids)).order_by(Product.id):
+        products[product.order_id].append(product)
+    return products
+
+def api_conditional_response(etag, build_payload):
+    # If-None-Match يطابق => 304 بدون بناء الاستجابة (ولا تحميل المنتجات)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(build_payload())
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@app.route('/api/v1/auth/token', methods=['POST'])
+def api_issue_token():
+    payload = request.get_json(silent=True) or {}
+    user = User.query.filter_by(username=payload.get('username', '')).first()
+    if not user or not user.check_password(payload.get('password', '')):
+        return api_error('invalid username or password', 401)
+    return jsonify({
+        'access_token': create_access_token(identity=str(user.id)),
+        'token_type': 'Bearer',
+        'expires_in': int(app.config['JWT_ACCESS_TOKEN_EXPIRES'].total_seconds()),
+    })
+
+@app.route('/api/v1/orders')
+@jwt_required()
+def api_list_orders():
+    try:
+        fields = parse_api_fields(request.args.get('fields'))
+    except ValueError as e:
+        return api_error(str(e), 400)
+    filters = get_order_filters(request.args)
+    query, sort_column, parse_cursor = build_order_listing(filters)
+    page = paginate_orders(
+        query,
+        get_page_size(request.args),
+        after=decode_cursor(request.args.get('after'), parse_cursor),
+        before=decode_cursor(request.args.get('before'), parse_cursor),
+        sort_column=sort_column
+    )
+    orders = page['items']
+    # الصفحة تتغير فقط إذا تغيرت طلباتها أو نسخها أو المؤشرات أو الحقول المطلوبة
+    etag = hashlib.sha256(json.dumps([
+        fields, [(order.id, order.version) for order in orders], page['next_cursor'], page['prev_cursor']
+    ]).encode()).hexdigest()
+
+    def build_payload():
+        products = load_products_by_order([order.id for order in orders]) if 'products' in fields else {}
+        return {
+            'data': [order_api_record(order, fields, products.get(order.id)) for order in orders],
+            'next_cursor': page['next_cursor'],
+            'prev_cursor': page['prev_cursor'],
+        }
+    return api_conditional_response(etag, build_payload)
+
+@app.route('/api/v1/orders/<int:order_id>')
+@jwt_required()
+def api_get_order(order_id):
+    try:
+        fields = parse_api_fields(request.args.get('fields'))
+    except ValueError as e:
+        return api_error(str(e), 400)
+    order = db.session.get(Order, order_id)
+    if order is None:
+        return api_error('order not found', 404)
+    etag = f"order-{order.id}-v{order.version}-{hashlib.sha256(','.join(fields).encode()).hexdigest()[:12]}"
+    return api_conditional_response(etag, lambda: order_api_record(order, fields))
+
+@app.route('/api/v1/orders/bulk-status', methods=['POST'])
+@jwt_required()
+def api_bulk_update_status():
+    # {"order_ids": [...]} أو {"filter": {...فلاتر لوحة التحكم...}} مع order_status و/أو payment_status
+    # فلتر فارغ يعني كل الطلبات، فلا يُقبل إلا مع "confirm_all": true
+    payload = request.get_json(silent=True) or {}
+    order_status = payload.get('order_status') or ''
+    payment_status = payload.get('payment_status') or ''
+    try:
+        validate_status_changes(order_status, payment_status)
+    except ValueError:
+        return api_error(
+            f"order_status must be one of {list(ORDER_STATUSES)} and payment_status one of {list(PAYMENT_STATUSES)}", 400
+        )
+    if isinstance(payload.get('filter'), dict):
+        try:
+            filters = strict_order_filters(payload['filter'])
+        except ValueError as e:
+            return api_error(str(e), 400)
+        if not filters and payload.get('confirm_all') is not True:
+            return api_error('empty filter matches every order; send "confirm_all": true to proceed', 400)
+        order_ids = filtered_order_ids(filters)
+    elif isinstance(payload.get('order_ids'), list) and all(
+            isinstance(order_id, int) and not isinstance(order_id, bool) for order_id in payload['order_ids']):
+        if not all(fits_sqlite_integer(order_id) for order_id in payload['order_ids']):
+            return api_error('order_ids must be 64-bit integers', 400)
+        order_ids = sorted(set(payload['order_ids']))
+    else:
+        return api_error('provide either order_ids (list of integers) or filter (object)', 400)
+    updated = bulk_update_order_status(order_ids, order_status, payment_status)
+    return jsonify({'matched': len(order_ids), 'updated': updated})
+
+@app.route('/api/v1/stats')
+@jwt_required()
+def api_stats():
+    try:
+        stats = compute_order_stats(request.args.get('date_from', ''), request.args.get('date_to', ''))
+    except ValueError:
+        return api_error('date_from/date_to must be YYYY-MM-DD', 400)
+    payload = {
+        **{key: value for key, value in stats.items() if key != 'top_cities'},
+        'top_cities': [{'destination_city': city, 'order_count': count} for city, count in stats['top_cities']],
+    }
+    etag = hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+    return api_conditional_response(etag, lambda: payload)
+
 # --- دوال إدارة النظام (النسخ الاحتياطي) ---
+def sqlite_online_backup(source_path, target_path):
+    # نسخ متسق أثناء عمل التطبيق: صفحات على دفعات مع توقف قصير بينها حتى لا تتعطل عمليات الكتابة
+    step_sleep = app.config['BACKUP_STEP_SLEEP']
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    try:
+        source.backup(
+            target,
+            pages=app.config['BACKUP_PAGES_PER_STEP'],
+            progress=lambda status, remaining, total: time.sleep(step_sleep) if remaining else None
+        )
+        page_count = target.execute('PRAGMA page_count').fetchone()[0]
+        page_size = target.execute('PRAGMA page_size').fetchone()[0]
+        integrity = target.execute('PRAGMA integrity_check').fetchone()[0]
+    finally:
+        target.close()
+        source.close()
+    return page_count, page_size, integrity
+
+def record_backup(record):
+    with open(instance_path('backup_log.jsonl'), 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+# --- مخزن النسخ الاحتياطية المقسّم (Content-Addressed Chunk Store) ---
+class BackupStoreLock:
+    # مع عدة عمال (gunicorn) لا يكفي قفل الخيوط: flock على backups/store.lock يحمي الفهرس والأجزاء بين العمليات
+    # قابل لإعادة الدخول داخل نفس الخيط (كتابة manifest تُحدّث الفهرس وهي تحمل القفل)
+    def __init__(self):
+        self.thread_lock = threading.RLock()
+        self.depth = 0
+        self.lock_file = None
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        if self.depth == 0:
+            try:
+                self.lock_file = acquire_file_lock(backup_path('store.lock'), blocking=True)
+            except BaseException:
+                self.thread_lock.release()
+                raise
+        self.depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.depth -= 1
+        if self.depth == 0:
+            self.lock_file.close()
+            self.lock_file = None
+        self.thread_lock.release()
+
+backup_store_lock = BackupStoreLock()
+LEGACY_BACKUP_OPENERS = {'.gz': gzip.open, '.xz': lzma.open}
+
+# كل نسخة = ملف manifest يشير إلى أجزاء ثابتة الحجم مضغوطة ومسماة ببصمتها؛ الأجزاء غير المتغيرة لا تُخزن مرتين
+def backup_chunk_path(digest):
+    return os.path.join(backup_chunk_dir(), digest[:2], f'{digest}.zz')
+
+def backup_manifest_path(name):
+    # الاسم يأتي من المستخدم، فلا يُسمح بأي مسار
+    if not name or os.path.basename(name) != name:
+        raise FileNotFoundError(name)
+    return os.path.join(backup_manifest_dir(), f'{name}.json')
+
+def backup_timestamp():
+    # بدقة الميكروثانية: نسخة يدوية ونسخة مجدولة (أو عاملان) في نفس الثانية يجب ألا تحملا نفس الاسم
+    return datetime.now().strftime('%Y-%m-%d_%H-%M-%S-%f')
+
+def store_backup_chunks(source_path):
+    chunk_size = app.config['BACKUP_CHUNK_SIZE']
+    chunks = []
+    new_bytes = 0
+    file_hash = hashlib.sha256()
+    with open(source_path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            file_hash.update(chunk)
+            digest = hashlib.sha256(chunk).hexdigest()
+            path = backup_chunk_path(digest)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                data = zlib.compress(chunk, app.config['BACKUP_COMPRESSION_LEVEL'])
+                temp_path = f'{path}.{os.getpid()}.tmp'
+                with open(temp_path, 'wb') as chunk_file:
+                    chunk_file.write(data)
+                os.replace(temp_path, path)
+                new_bytes += len(data)
+            chunks.append(digest)
+    return chunks, new_bytes, file_hash.hexdigest()
+
+def write_backup_manifest(name, source_path, **details):
+    # القفل يمنع حذف جزء أثناء التنظيف بينما نسخة جديدة تعتمد على وجوده
+    with backup_store_lock:
+        manifest = _write_backup_manifest(name, source_path, details)
+        update_backup_index(add=[backup_summary(manifest)])
+    return manifest
+
+def _write_backup_manifest(name, source_path, details):
+    # يُستدعى والقفل محجوز، فلا يمكن لعملية أخرى إنشاء نفس الاسم بين الفحص والكتابة
+    if os.path.exists(backup_manifest_path(name)):
+        raise FileExistsError(f'backup {name} already exists')
+    chunks, new_bytes, file_sha256 = store_backup_chunks(source_path)
+    manifest = {
+        'name': name,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'size_bytes': os.path.getsize(source_path),
+        'physical_bytes': new_bytes,
+        'chunk_size': app.config['BACKUP_CHUNK_SIZE'],
+        'sha256': file_sha256,
+        **details,
+        'chunks': chunks,
+    }
+    path = backup_manifest_path(name)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(temp_path, path)
+    return manifest
+
+def read_backup_manifest(name):
+    with open(backup_manifest_path(name), encoding='utf-8') as f:
+        return json.load(f)
+
+def iter_backup_chunks(manifest):
+    for digest in manifest['chunks']:
+        with open(backup_chunk_path(digest), 'rb') as f:
+            yield zlib.decompress(f.read())
+
+def materialize_backup(name, target_path):
+    # يعيد بناء ملف قاعدة البيانات من manifest، أو ينسخ ملف .db قديماً إن وُجد بهذا الاسم
+    try:
+        manifest = read_backup_manifest(name)
+    except FileNotFoundError:
+        summary = read_backup_index().get(name)
+        if not summary or 'file' not in summary:
+            raise
+        legacy_path = backup_path(summary['file'])
+        opener = LEGACY_BACKUP_OPENERS.get(os.path.splitext(legacy_path)[1], open)
+        with opener(legacy_path, 'rb') as source, open(target_path, 'wb') as target:
+            shutil.copyfileobj(source, target, 1024 * 1024)
+        return
+    file_hash = hashlib.sha256()
+    with open(target_path, 'wb') as f:
+        for chunk in iter_backup_chunks(manifest):
+            file_hash.update(chunk)
+            f.write(chunk)
+    if file_hash.hexdigest() != manifest['sha256']:
+        os.remove(target_path)
+        raise ValueError(f'backup {name} is corrupted (checksum mismatch)')
+
+# --- فهرس النسخ الاحتياطية: ملف واحد يغني صفحة الإدارة عن فحص كل ملف على القرص ---
+def backup_summary(manifest):
+    return {key: value for key, value in manifest.items() if key != 'chunks'}
+
+def legacy_backup_summary(entry):
+    # ملفات .db الكاملة من الإصدارات السابقة (وقد تكون مضغوطة gz/xz بعد التنظيف)
+    stat = entry.stat()
+    name, ext = os.path.splitext(entry.name)
+    if ext not in LEGACY_BACKUP_OPENERS:
+        name = entry.name
+    return {
+        'name': name,
+        'file': entry.name,
+        'created_at': datetime.fromtimestamp(stat.st_mtime).isoformat(timespec='seconds'),
+        'size_bytes': stat.st_size,
+        'physical_bytes': stat.st_size,
+    }
+
+def rebuild_backup_index():
+    index = {}
+    with os.scandir(backup_manifest_dir()) as it:
+        for entry in it:
+            if entry.name.endswith('.json'):
+                with open(entry.path, encoding='utf-8') as f:
+                    summary = backup_summary(json.load(f))
+                index[summary['name']] = summary
+    with os.scandir(app.config['BACKUP_DIR']) as it:
+        for entry in it:
+            if entry.is_file() and entry.name.endswith(('.db', '.db.gz', '.db.xz')):
+                summary = legacy_backup_summary(entry)
+                index[summary['name']] = summary
+    write_backup_index(index)
+    return index
+
+def read_backup_index():
+    try:
+        with open(backup_path('index.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        with backup_store_lock:
+            return rebuild_backup_index()
+
+def write_backup_index(index):
+    # اسم مؤقت لكل عملية حتى لا تتبادل عمليتان نفس الملف قبل os.replace
+    index_path = backup_path('index.json')
+    temp_path = f'{index_path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(temp_path, index_path)
+
+def update_backup_index(add=(), remove=()):
+    with backup_store_lock:
+        index = read_backup_index()
+        for summary in add:
+            index[summary['name']] = summary
+        for name in remove:
+            index.pop(name, None)
+        write_backup_index(index)
+
+def list_backups():
+    backups = list(read_backup_index().values())
+    return sorted(backups, key=lambda backup: backup['name'], reverse=True)
+
 def perform_backup():
     with app.app_context():
         try:
-            if not os.path.exists(DB_PATH):
+            if not os.path.exists(database_path()):
                 print("Warning: Database not found for scheduled backup.")
-                return
-            timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-            backup_filename = f'auto-backup-{timestamp}.db'
-            backup_path = os.path.join(BACKUP_DIR, backup_filename)
-            shutil.copy2(DB_PATH, backup_path)
-            print(f"Successfully created scheduled backup: {backup_filename}")
+                return None
+            backup_filename = f'auto-backup-{backup_timestamp()}.db'
+            temp_path = instance_path(backup_filename + '.tmp')
+            started = time.perf_counter()
+            page_count, page_size, integrity = sqlite_online_backup(database_path(), temp_path)
+            if integrity != 'ok':
+                os.remove(temp_path)
+                print(f"Error during scheduled backup: integrity check failed ({integrity})")
+                return None
+            try:
+                manifest = write_backup_manifest(
+                    backup_filename, temp_path,
+                    page_count=page_count,
+                    page_size=page_size,
+                    duration_ms=round((time.perf_counter() - started) * 1000, 1),
+                    integrity=integrity
+                )
+            finally:
+                os.remove(temp_path)
+            manifest.pop('chunks')
+            record_backup(manifest)
+            print(f"Successfully created scheduled backup: {backup_filename} "
+                  f"({manifest['size_bytes']} bytes logical, {manifest['physical_bytes']} bytes new, "
+                  f"{page_count} pages, {manifest['duration_ms']} ms)")
+            return manifest
         except Exception as e:
             print(f"Error during scheduled backup: {e}")
+            return None
+
+# --- سياسة الاحتفاظ بالنسخ الاحتياطية وتنظيف الأجزاء غير المستخدمة ---
+def select_backups_to_keep(backups, daily, weekly, monthly):
+    newest_first = sorted(backups, key=lambda backup: backup['created_at'], reverse=True)
+    periods = (
+        (daily, lambda moment: moment.date()),
+        (weekly, lambda moment: moment.isocalendar()[:2]),
+        (monthly, lambda moment: (moment.year, moment.month)),
+    )
+    keep = set()
+    for limit, period_of in periods:
+        seen_periods = set()
+        for backup in newest_first:
+            period = period_of(datetime.fromisoformat(backup['created_at']))
+            if period in seen_periods:
+                continue
+            if len(seen_periods) == limit:
+                break
+            seen_periods.add(period)
+            keep.add(backup['name'])
+    return keep
+
+def compress_legacy_backup(summary):
+    # ضغط متدفق لملف .db كامل دون تحميله في الذاكرة
+    ext = '.' + app.config['BACKUP_LEGACY_COMPRESSION']
+    source_path = backup_path(summary['file'])
+    archive_path = source_path + ext
+    temp_path = f'{archive_path}.{os.getpid()}.tmp'
+    with open(source_path, 'rb') as source, LEGACY_BACKUP_OPENERS[ext](temp_path, 'wb') as target:
+        shutil.copyfileobj(source, target, 1024 * 1024)
+    os.replace(temp_path, archive_path)
+    os.remove(source_path)
+    return {**summary, 'file': os.path.basename(archive_path), 'physical_bytes': os.path.getsize(archive_path)}
+
+def delete_backup(summary):
+    if 'file' in summary:
+        os.remove(backup_path(summary['file']))
+    else:
+        os.remove(backup_manifest_path(summary['name']))
+
+def collect_unused_backup_chunks():
+    # الأجزاء المستخدمة تُحسب من ملفات manifest على القرص وليس من الفهرس: نسخة ناقصة من الفهرس
+    # يجب ألا تؤدي إلى حذف أجزاء نسخة ما زالت موجودة
+    referenced = set()
+    with os.scandir(backup_manifest_dir()) as it:
+        for entry in it:
+            if entry.name.endswith('.json'):
+                with open(entry.path, encoding='utf-8') as f:
+                    referenced.update(json.load(f)['chunks'])
+    removed, freed_bytes = 0, 0
+    for directory, _, filenames in os.walk(backup_chunk_dir()):
+        for filename in filenames:
+            if filename.split('.', 1)[0] not in referenced:
+                path = os.path.join(directory, filename)
+                freed_bytes += os.path.getsize(path)
+                os.remove(path)
+                removed += 1
+    return removed, freed_bytes
+
+def prune_backups(dry_run=False):
+    # النسخ المرفوعة يدوياً لا تخضع للحذف التلقائي
+    with backup_store_lock:
+        index = read_backup_index()
+        candidates = [backup for backup in index.values() if backup['name'].startswith('auto-backup-')]
+        keep = select_backups_to_keep(
+            candidates,
+            app.config['BACKUP_KEEP_DAILY'],
+            app.config['BACKUP_KEEP_WEEKLY'],
+            app.config['BACKUP_KEEP_MONTHLY']
+        )
+        expired = [backup for backup in candidates if backup['name'] not in keep]
+        result = {'kept': len(index) - len(expired), 'deleted': [backup['name'] for backup in expired],
+                  'compressed': 0, 'chunks_removed': 0, 'freed_bytes': 0}
+        if dry_run:
+            return result
+        for backup in expired:
+            # أجزاء النسخ المقسمة قد تكون مشتركة، فلا يُحسب حجمها إلا عند حذفها فعلياً أدناه
+            if 'file' in backup:
+                result['freed_bytes'] += backup['physical_bytes']
+            delete_backup(backup)
+            del index[backup['name']]
+        for name, backup in index.items():
+            if backup.get('file', '').endswith('.db'):
+                index[name] = compress_legacy_backup(backup)
+                result['freed_bytes'] += backup['physical_bytes'] - index[name]['physical_bytes']
+                result['compressed'] += 1
+        write_backup_index(index)
+        result['chunks_removed'], freed_chunk_bytes = collect_unused_backup_chunks()
+        result['freed_bytes'] += freed_chunk_bytes
+    return result
+
+@app.cli.command('prune-backups')
+@click.option('--dry-run', is_flag=True, help='List the backups that would be deleted without touching them.')
+def prune_backups_command(dry_run):
+    result = prune_backups(dry_run=dry_run)
+    action = 'Would delete' if dry_run else 'Deleted'
+    print(f"{action} {len(result['deleted'])} backups, kept {result['kept']}: {', '.join(result['deleted']) or 'none'}")
+    if not dry_run:
+        print(f"Compressed {result['compressed']} legacy files, removed {result['chunks_removed']} unused chunks, "
+              f"freed {result['freed_bytes']} bytes.")
+
+@app.cli.command('rebuild-backup-index')
+def rebuild_backup_index_command():
+    with backup_store_lock:
+        index = rebuild_backup_index()
+    print(f"Backup index rebuilt with {len(index)} backups.")
+
+# --- الاستعادة الآمنة أثناء التشغيل (Hot Restore) ---
+class RequestGate:
+    # يوقف الطلبات الجديدة مؤقتاً وينتظر انتهاء الجارية قبل تبديل قاعدة البيانات
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.active = 0
+        self.closed = False
+
+    def enter(self):
+        with self.condition:
+            while self.closed:
+                self.condition.wait()
+            self.active += 1
+
+    def leave(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+    @contextmanager
+    def paused(self, timeout):
+        # طلب الاستعادة نفسه ما زال نشطاً، لذا ننتظر حتى يبقى طلب واحد فقط
+        with self.condition:
+            self.closed = True
+            drained = self.condition.wait_for(lambda: self.active <= 1, timeout)
+        try:
+            if not drained:
+                raise RuntimeError('timed out waiting for in-flight requests to finish')
+            yield
+        finally:
+            with self.condition:
+                self.closed = False
+                self.condition.notify_all()
+
+request_gate = RequestGate()
+
+# RequestGate يوقف خيوط العملية الحالية فقط؛ مع عدة عمال (gunicorn) يحمل كل طلب قفلاً مشتركاً على
+# instance/requests.lock وتأخذ الاستعادة قفلاً حصرياً عليه. قفل restore.lock يُعلن نية الاستعادة حتى
+# لا تمنعها الطلبات الجديدة من الحصول على القفل الحصري، ووقت تعديله يخبر بقية العمال بحدوث استعادة
+restore_generation = {'seen': None}
+
+def reset_process_caches():
+    # حالة محفوظة في ذاكرة العملية لا تصلح بعد تبديل قاعدة البيانات
+    invalidate_order_count_cache()
+    invoice_jobs.clear()
+    for key in invoice_cache_stats:
+        invoice_cache_stats[key] = 0
+
+def sync_restore_generation(restore_lock):
+    generation = os.fstat(restore_lock.fileno()).st_mtime_ns
+    if restore_generation['seen'] is not None and restore_generation['seen'] != generation:
+        db.engine.dispose()
+        reset_process_caches()
+    restore_generation['seen'] = generation
+
+@app.before_request
+def enter_request_gate():
+    request_gate.enter()
+    restore_lock = acquire_file_lock(instance_path('restore.lock'), blocking=True, shared=True)
+    try:
+        g.active_request_lock = acquire_file_lock(instance_path('requests.lock'), blocking=True, shared=True)
+        sync_restore_generation(restore_lock)
+    finally:
+        restore_lock.close()
+
+@app.teardown_request
+def leave_request_gate(exc):
+    active_request_lock = g.pop('active_request_lock', None)
+    if active_request_lock:
+        active_request_lock.close()
+    request_gate.leave()
+
+@contextmanager
+def all_workers_paused(timeout):
+    # طلب الاستعادة نفسه يحمل قفلاً مشتركاً، فيُحرر أولاً وإلا انتظر نفسه
+    active_request_lock = g.pop('active_request_lock', None)
+    if active_request_lock:
+        active_request_lock.close()
+    restore_lock = acquire_file_lock_within(instance_path('restore.lock'), timeout)
+    if restore_lock is None:
+        raise RuntimeError('another restore is in progress')
+    try:
+        requests_lock = acquire_file_lock_within(instance_path('requests.lock'), timeout)
+        if requests_lock is None:
+            raise RuntimeError('timed out waiting for requests in other workers to finish')
+        try:
+            yield
+            restore_lock.truncate(0)
+            restore_lock.write(f'{os.getpid()} {datetime.now().isoformat()}\n')
+            restore_lock.flush()
+            restore_generation['seen'] = os.fstat(restore_lock.fileno()).st_mtime_ns
+        finally:
+            requests_lock.close()
+    finally:
+        restore_lock.close()
+
+def required_backup_columns():
+    # الأعمدة التي تضيفها الترحيلات ليست مطلوبة في النسخ القديمة
+    required = {}
+    for table in (User.__table__, Order.__table__, Product.__table__):
+        added_later = SCHEMA_COLUMNS.get(table.name, {})
+        required[table.name] = {column.name for column in table.columns if column.name not in added_later}
+    return required
+
+def validate_backup_file(path):
+    conn = sqlite3.connect(f'file:{quote(path)}?mode=ro', uri=True)
+    try:
+        integrity = conn.execute('PRAGMA integrity_check').fetchone()[0]
+        if integrity != 'ok':
+            raise ValueError(f'integrity check failed ({integrity})')
+        for table, columns in required_backup_columns().items():
+            existing = {row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')}
+            if not existing:
+                raise ValueError(f'missing table {table}')
+            missing = columns - existing
+            if missing:
+                raise ValueError(f'table {table} is missing columns: {", ".join(sorted(missing))}')
+    except sqlite3.DatabaseError as e:
+        raise ValueError(f'not a valid SQLite database ({e})')
+    finally:
+        conn.close()
+
+def restore_database(candidate_path):
+    # النسخ بواجهة SQLite للنسخ الاحتياطي بدل إعادة تسمية الملف: يتم في معاملة واحدة تحت أقفال SQLite،
+    # فالاتصالات المفتوحة في العمليات الأخرى ترى المحتوى الجديد بدل ملف محذوف (inode قديم)
+    validate_backup_file(candidate_path)
+    started = time.perf_counter()
+    timeout = app.config['RESTORE_DRAIN_TIMEOUT']
+    with request_gate.paused(timeout), all_workers_paused(timeout):
+        db.session.remove()
+        db.engine.dispose()
+        source = sqlite3.connect(candidate_path)
+        target = sqlite3.connect(database_path(), timeout=app.config['RESTORE_DRAIN_TIMEOUT'])
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        db.engine.dispose()
+        db.create_all()
+        run_schema_migrations()
+        reset_process_caches()
+        clear_invoice_cache()
+        held_ms = round((time.perf_counter() - started) * 1000, 1)
+    print(f"Database restored from {os.path.basename(candidate_path)}; requests held in all workers for {held_ms} ms")
+    return held_ms
 
 @app.route('/system')
 @login_required
 def system_management():
-    backup_files = sorted(os.listdir(BACKUP_DIR), reverse=True)
-    return render_template('system_management.html', backups=backup_files)
+    backups = list_backups()
+    return render_template(
+        'system_management.html',
+        backups=backups,
+        logical_total=sum(backup['size_bytes'] for backup in backups),
+        physical_total=sum(backup['physical_bytes'] for backup in backups),
+        invoice_cache=invoice_cache_stats
+    )
 
 @app.route('/system/backup/create')
 @login_required
 def create_backup():
-    perform_backup()
-    flash('تم إنشاء نسخة احتياطية يدوية بنجاح.', 'success')
+    if perform_backup():
+        flash('تم إنشاء نسخة احتياطية يدوية بنجاح.', 'success')
+    else:
+        flash('فشل إنشاء النسخة الاحتياطية، راجع سجل الخادم.', 'danger')
     return redirect(url_for('system_management'))
 
 @app.route('/system/backup/restore', methods=['POST'])
@@ -1351,12 +3791,19 @@ def restore_backup():
         if not backup_file:
             flash('الرجاء اختيار ملف نسخة احتياطية.', 'warning')
             return redirect(url_for('system_management'))
-        backup_path = os.path.join(BACKUP_DIR, backup_file)
-        if not os.path.exists(backup_path):
+        restore_path = database_path() + '.restore.tmp'
+        try:
+            materialize_backup(backup_file, restore_path)
+        except FileNotFoundError:
             flash('ملف النسخة الاحتياطية المختار غير موجود.', 'danger')
             return redirect(url_for('system_management'))
-        shutil.copy2(backup_path, DB_PATH)
-        flash(f'تم استعادة النظام بنجاح من النسخة الاحتياطية: {backup_file}.', 'success')
+        try:
+            held_ms = restore_database(restore_path)
+        finally:
+            os.remove(restore_path)
+        flash(f'تم استعادة النظام بنجاح من النسخة الاحتياطية: {backup_file} (توقفت الطلبات {held_ms:.0f} ms).', 'success')
+    except ValueError as e:
+        flash(f'النسخة الاحتياطية غير صالحة ولم تتم الاستعادة: {e}', 'danger')
     except Exception as e:
         flash(f'حدث خطأ أثناء استعادة النسخة الاحتياطية: {e}', 'danger')
     return redirect(url_for('system_management'))
@@ -1365,7 +3812,19 @@ def restore_backup():
 @login_required
 def download_backup(filename):
     try:
-        return send_from_directory(directory=BACKUP_DIR, path=filename, as_attachment=True)
+        manifest = read_backup_manifest(filename)
+        return Response(
+            iter_backup_chunks(manifest),
+            mimetype='application/octet-stream',
+            headers={**attachment_headers(filename), 'Content-Length': str(manifest['size_bytes'])}
+        )
+    except FileNotFoundError:
+        pass
+    summary = read_backup_index().get(filename)
+    try:
+        if not summary or 'file' not in summary:
+            raise FileNotFoundError(filename)
+        return send_from_directory(directory=app.config['BACKUP_DIR'], path=summary['file'], as_attachment=True)
     except FileNotFoundError:
         flash("الملف المطلوب غير موجود.", "danger")
         return redirect(url_for('system_management'))
@@ -1386,14 +3845,18 @@ def upload_backup():
     if file and file.filename.endswith('.db'):
         try:
             filename = secure_filename(file.filename)
-            timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-            new_filename = f"uploaded-backup-{timestamp}-{filename}"
+            new_filename = f"uploaded-backup-{backup_timestamp()}-{filename}"
             
-            upload_path = os.path.join(BACKUP_DIR, new_filename)
+            upload_path = instance_path(new_filename + '.tmp')
             file.save(upload_path)
-            
-            shutil.copy2(upload_path, DB_PATH)
-            flash(f'تم رفع واستعادة النسخة الاحتياطية "{filename}" بنجاح.', 'success')
+            try:
+                held_ms = restore_database(upload_path)
+                write_backup_manifest(new_filename, upload_path)
+            finally:
+                os.remove(upload_path)
+            flash(f'تم رفع واستعادة النسخة الاحتياطية "{filename}" بنجاح (توقفت الطلبات {held_ms:.0f} ms).', 'success')
+        except ValueError as e:
+            flash(f'الملف المرفوع ليس نسخة احتياطية صالحة: {e}', 'danger')
         except Exception as e:
             flash(f'حدث خطأ أثناء رفع واستعادة الملف: {e}', 'danger')
     else:
@@ -1408,15 +3871,67 @@ def scheduled_backup_job():
     print("Running scheduled backup job...")
     perform_backup()
 
-if __name__ == '__main__':
+@scheduler.task('cron', id='backup_retention_job', hour=3, minute=30)
+def backup_retention_job():
     with app.app_context():
-        db.create_all()
-        if not User.query.filter_by(username='admin').first():
-            print("Creating default admin user...")
-            default_admin = User(username='admin')
-            default_admin.set_password('admin_password')
-            db.session.add(default_admin)
-            db.session.commit()
-            print("Default admin user created with username 'admin' and password 'admin_password'")
-    
+        try:
+            result = prune_backups()
+            print(f"Backup retention: deleted {len(result['deleted'])}, kept {result['kept']}, "
+                  f"compressed {result['compressed']}, removed {result['chunks_removed']} chunks, "
+                  f"freed {result['freed_bytes']} bytes.")
+        except Exception as e:
+            print(f"Error during backup retention job: {e}")
+
+@app.cli.command('benchmark-startup')
+@click.option('--budget-ms', type=float, default=None, help='Fail when cold start exceeds this (default: STARTUP_BUDGET_MS).')
+def benchmark_startup_command(budget_ms):
+    # عملية جديدة حتى تكون الوحدات غير محملة مسبقاً؛ python -X importtime يطبع زمن استيراد كل وحدة إلى stderr
+    budget_ms = budget_ms or app.config['STARTUP_BUDGET_MS']
+    probe = ('import time; started = time.perf_counter(); import app; app.create_app(); '
+             'print(f"startup_ms={(time.perf_counter() - started) * 1000:.1f}")')
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', probe], cwd=basedir, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise SystemExit(result.stderr)
+    startup_ms = float(result.stdout.strip().splitlines()[-1].split('=')[1])
+    imported, direct_imports = set(), []
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line and 'self' not in line:
+            _, cumulative, module = line.split('|')
+            # كل مستوى تداخل يضيف مسافتين؛ المستوى الأول هو ما يستورده app.py مباشرة
+            depth = (len(module) - len(module.lstrip()) - 1) // 2
+            imported.add(module.strip())
+            if depth == 1:
+                direct_imports.append((int(cumulative) / 1000, module.strip()))
+    print(f"Cold start (import app + create_app): {startup_ms:.1f} ms, budget {budget_ms:.0f} ms")
+    print("Slowest imports of app.py:")
+    for cumulative_ms, module in sorted(direct_imports, reverse=True)[:10]:
+        print(f"  {cumulative_ms:8.1f} ms  {module}")
+    eager = [module for module in ('weasyprint', 'requests') if module in imported]
+    if eager:
+        print(f"Imported at startup but should be lazy: {', '.join(eager)}")
+    if startup_ms > budget_ms or eager:
+        raise SystemExit(1)
+
+def init_database():
+    # كل عامل يستدعيها عند بدء التشغيل؛ القفل يمنع تشغيل الترحيلات في أكثر من عملية في الوقت نفسه
+    migration_lock = acquire_file_lock(instance_path('migrate.lock'), blocking=True)
+    try:
+        with app.app_context():
+            db.create_all()
+            run_schema_migrations()
+            if not User.query.filter_by(username='admin').first():
+                print("Creating default admin user...")
+                default_admin = User(username='admin')
+                default_admin.set_password('admin_password')
+                db.session.add(default_admin)
+                db.session.commit()
+                print("Default admin user created with username 'admin' and password 'admin_password'")
+    finally:
+        migration_lock.close()
+
+if __name__ == '__main__':
+    create_app({'SCHEDULER_ENABLED': True})
+    init_database()
     app.run(debug=True, host='0.0.0.0')
@@ -0,0 +1,10 @@
+# إعدادات gunicorn؛ كل عامل يحمّل التطبيق بنفسه، والمهام المجدولة تعمل في عامل واحد فقط (قفل instance/scheduler.lock)
+import os
+
+bind = f"{os.environ.get('HOST', '0.0.0.0')}:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_WORKERS', '2'))
+threads = int(os.environ.get('WEB_THREADS', '4'))
+worker_class = 'gthread'
+# تصدير الفواتير بالجملة قد يستغرق وقتاً أطول من المهلة الافتراضية (30 ثانية)
+timeout = int(os.environ.get('WEB_TIMEOUT', '120'))
+accesslog = '-'
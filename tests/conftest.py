@@ -0,0 +1,76 @@
+# كل اختبار يعمل على قاعدة بيانات ومجلدات مؤقتة (tmp_path)، ولا يلمس instance/ أو backups/ الحقيقية
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+import app as marvella
+
+
+@pytest.fixture
+def app(tmp_path):
+    flask_app = marvella.create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / 'test.db'),
+        'INSTANCE_DIR': str(tmp_path / 'instance'),
+        'BACKUP_DIR': str(tmp_path / 'backups'),
+    })
+    marvella.init_database()
+    yield flask_app
+    with flask_app.app_context():
+        marvella.db.session.remove()
+        marvella.db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'admin_password'})
+    return client
+
+
+@pytest.fixture
+def make_orders(app):
+    def make_orders(count, cities=('الخرطوم', 'أم درمان'), start=datetime(2025, 1, 1)):
+        with app.app_context():
+            for i in range(count):
+                order = marvella.Order(
+                    customer_name=f'عميل {i}', customer_phone=f'0912{i:06d}', destination_city=cities[i % len(cities)],
+                    shipping_cost=10, order_status=marvella.ORDER_STATUSES[i % len(marvella.ORDER_STATUSES)],
+                    payment_status=marvella.PAYMENT_STATUSES[i % len(marvella.PAYMENT_STATUSES)],
+                    created_at=start + timedelta(hours=i)
+                )
+                marvella.db.session.add(order)
+                marvella.db.session.add(marvella.Product(description=f'فستان {i}', quantity=2, price=5.5, order=order))
+                order.refresh_costs()
+            marvella.db.session.commit()
+            marvella.rebuild_stats_rollup()
+            marvella.db.session.commit()
+    return make_orders
+
+
+@pytest.fixture
+def capture_statements(app):
+    # نفس أسلوب collect_view_queries: كل جملة SQL تمر عبر before_cursor_execute
+    @contextmanager
+    def capture_statements():
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        with app.app_context():
+            engine = marvella.db.engine
+        event.listen(engine, 'before_cursor_execute', capture)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, 'before_cursor_execute', capture)
+    return capture_statements
+
+
+@pytest.fixture
+def api_headers(client):
+    response = client.post('/api/v1/auth/token', json={'username': 'admin', 'password': 'admin_password'})
+    return {'Authorization': f"Bearer {response.get_json()['access_token']}"}
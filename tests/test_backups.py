@@ -0,0 +1,25 @@
+import os
+
+import pytest
+
+import app as marvella
+
+
+def test_backups_in_the_same_second_keep_separate_manifests(app, make_orders, tmp_path):
+    make_orders(3)
+    first, second = marvella.perform_backup(), marvella.perform_backup()
+    assert first['name'] != second['name']
+    with app.app_context():
+        assert {first['name'], second['name']} <= set(marvella.read_backup_index())
+        for name in (first['name'], second['name']):
+            marvella.materialize_backup(name, str(tmp_path / 'restored.db'))
+    assert not [name for name in os.listdir(tmp_path / 'instance') if name.endswith('.tmp')]
+
+
+def test_existing_manifest_is_never_overwritten(app, make_orders):
+    make_orders(3)
+    backup = marvella.perform_backup()
+    with app.app_context():
+        with pytest.raises(FileExistsError):
+            marvella.write_backup_manifest(backup['name'], marvella.database_path())
+        assert marvella.read_backup_manifest(backup['name'])['sha256'] == backup['sha256']
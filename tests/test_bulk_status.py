@@ -0,0 +1,28 @@
+import app as marvella
+
+
+def order_statuses(app):
+    with app.app_context():
+        return dict(marvella.db.session.query(marvella.Order.id, marvella.Order.order_status))
+
+
+def test_form_skips_out_of_range_order_ids(app, client, make_orders):
+    make_orders(3)
+    response = client.post('/orders/bulk-status', data={
+        'order_ids': ['9' * 30, '²', '2'], 'new_order_status': marvella.ORDER_STATUSES[-1],
+    })
+    assert response.status_code == 302
+    statuses = order_statuses(app)
+    assert statuses[2] == marvella.ORDER_STATUSES[-1]
+    assert statuses[1] != marvella.ORDER_STATUSES[-1]
+
+
+def test_api_rejects_out_of_range_order_ids(app, client, api_headers, make_orders):
+    make_orders(3)
+    before = order_statuses(app)
+    for order_ids in ([10**30], [2, -10**30]):
+        response = client.post('/api/v1/orders/bulk-status', headers=api_headers, json={
+            'order_ids': order_ids, 'order_status': marvella.ORDER_STATUSES[-1],
+        })
+        assert response.status_code == 400
+    assert order_statuses(app) == before
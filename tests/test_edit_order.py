@@ -0,0 +1,127 @@
+import re
+
+import pytest
+
+import app as marvella
+
+PRODUCT_WRITE_RE = re.compile(r'^(INSERT INTO|UPDATE|DELETE FROM) "?product"?\b', re.IGNORECASE)
+PRODUCT_TABLE_RE = re.compile(r'\b(FROM|JOIN|INTO|UPDATE) "?product"?(\s|$)', re.IGNORECASE)
+ORDER_FORM_FIELDS = ('customer_name', 'customer_phone', 'destination_city', 'shipping_cost',
+                     'order_status', 'payment_status')
+
+
+@pytest.fixture
+def order_id(app):
+    with app.app_context():
+        order = marvella.Order(customer_name='عميل', customer_phone='0912345678', destination_city='الخرطوم',
+                               shipping_cost=10, order_status='جديد', payment_status='لم يتم الدفع')
+        marvella.db.session.add_all([marvella.Product(description=f'item {i}', quantity=1, price=10, order=order)
+                                     for i in range(3)])
+        order.refresh_costs()
+        marvella.db.session.flush()
+        marvella.update_stats_rollup(marvella.order_rollup_values(order), 1)
+        marvella.db.session.commit()
+        return order.id
+
+
+def load_order(app, order_id):
+    with app.app_context():
+        order = marvella.db.session.get(marvella.Order, order_id)
+        return {
+            'fields': {field: str(getattr(order, field)) for field in ORDER_FORM_FIELDS},
+            'version': order.version,
+            'total_cost': order.total_cost,
+            'products': [(product.id, product.description, product.quantity, product.price)
+                         for product in order.products],
+        }
+
+
+def order_form_data(order, products, **overrides):
+    # products: قائمة (product_id أو '', الوصف, الكمية, السعر) كما يرسلها نموذج التعديل
+    return {
+        **order['fields'],
+        'product_id': [str(product[0]) for product in products],
+        'product_name': [product[1] for product in products],
+        'product_quantity': [str(product[2]) for product in products],
+        'product_price': [str(product[3]) for product in products],
+        **overrides,
+    }
+
+
+def product_writes(client, capture_statements, order_id, data):
+    with capture_statements() as statements:
+        assert client.post(f'/order/edit/{order_id}', data=data).status_code == 302
+    writes = [PRODUCT_WRITE_RE.match(statement.lstrip()) for statement in statements]
+    return sorted(match.group(1).upper() for match in writes if match)
+
+
+def test_unchanged_resubmit_writes_nothing(app, client, capture_statements, order_id):
+    order = load_order(app, order_id)
+    assert product_writes(client, capture_statements, order_id, order_form_data(order, order['products'])) == []
+    assert load_order(app, order_id)['version'] == order['version']
+
+
+def test_order_fields_only_skip_product_writes_and_search_index(app, client, capture_statements, order_id):
+    order = load_order(app, order_id)
+    data = order_form_data(order, order['products'], order_status='في الطريق', shipping_cost='25')
+    with capture_statements() as statements:
+        assert client.post(f'/order/edit/{order_id}', data=data).status_code == 302
+    # قراءة المنتجات مرة واحدة لمقارنتها بالنموذج، بدون كتابة ولا إعادة بناء صف البحث
+    assert [statement for statement in statements if PRODUCT_WRITE_RE.match(statement.lstrip())] == []
+    assert len([statement for statement in statements if PRODUCT_TABLE_RE.search(statement)]) == 1
+    assert [statement for statement in statements if 'order_search' in statement] == []
+    after = load_order(app, order_id)
+    assert after['products'] == order['products']
+    assert after['total_cost'] == 55
+
+
+def test_indexed_field_edits_refresh_search(app, client, order_id):
+    order = load_order(app, order_id)
+    first, second, third = order['products']
+    client.post(f'/order/edit/{order_id}', data=order_form_data(
+        order, [first, second, (third[0], 'قفطان', third[2], third[3])], customer_name='سلمى'))
+    with app.app_context():
+        for term in ('سلمى', 'قفطان'):
+            query, _, _ = marvella.build_order_listing({'search_term': term})
+            assert [found.id for found in query] == [order_id]
+
+
+def test_product_diff_insert_update_delete(app, client, capture_statements, order_id):
+    order = load_order(app, order_id)
+    first, second, third = order['products']
+    data = order_form_data(order, [first, (second[0], second[1], second[2], 12.5), ('', 'item 3', 2, 7)])
+    assert product_writes(client, capture_statements, order_id, data) == ['DELETE FROM', 'INSERT INTO', 'UPDATE']
+    after = load_order(app, order_id)
+    product_ids = [product[0] for product in after['products']]
+    assert product_ids[:2] == [first[0], second[0]]
+    assert third[0] not in product_ids
+    assert after['total_cost'] == 10 + 12.5 + 14 + 10
+
+
+def test_edit_keeps_rollup_consistent(app, client, order_id):
+    order = load_order(app, order_id)
+    client.post(f'/order/edit/{order_id}', data=order_form_data(
+        order, order['products'][:1], order_status='تم التسليم', payment_status='تم الدفع'))
+    with app.app_context():
+        rollup = marvella.OrderStatsRollup.query.filter(marvella.OrderStatsRollup.order_count != 0).all()
+        assert [(row.order_status, row.payment_status, row.order_count, row.products_revenue) for row in rollup] == [
+            ('تم التسليم', 'تم الدفع', 1, 10)]
+
+
+def test_edit_bumps_version_once(app, client, order_id):
+    order = load_order(app, order_id)
+    assert order['version'] == 1
+    first, second, _ = order['products']
+    client.post(f'/order/edit/{order_id}', data=order_form_data(
+        order, [first, (second[0], 'renamed', second[2], second[3])], order_status='تم الشراء'))
+    assert load_order(app, order_id)['version'] == 2
+
+
+def test_new_order_starts_at_version_one(app, client):
+    client.post('/order/add', data={
+        'customer_name': 'عميل', 'customer_phone': '0912345678', 'destination_city': 'الخرطوم',
+        'shipping_cost': '10', 'order_status': 'جديد', 'payment_status': 'لم يتم الدفع',
+        'product_name': 'فستان', 'product_quantity': '1', 'product_price': '20',
+    })
+    with app.app_context():
+        assert [order.version for order in marvella.Order.query.all()] == [1]
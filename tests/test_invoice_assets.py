@@ -0,0 +1,27 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+import app as marvella
+
+
+def weasyprint_available():
+    try:
+        import weasyprint  # noqa: F401
+    except (ImportError, OSError):
+        return False
+    return True
+
+
+def loaded_invoice_assets():
+    return sorted(marvella.invoice_assets), marvella.invoice_font_css()
+
+
+@pytest.mark.skipif(not weasyprint_available(), reason='WeasyPrint is not usable here')
+def test_spawned_render_workers_load_invoice_assets():
+    marvella.load_invoice_assets()
+    expected = loaded_invoice_assets()
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(1, mp_context=context, initializer=marvella.init_invoice_renderer) as pool:
+        assert pool.submit(loaded_invoice_assets).result() == expected
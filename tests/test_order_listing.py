@@ -0,0 +1,34 @@
+import pytest
+
+LONG_NUMBERS = ['12345678901234567890123', '9' * 25, '+249 ' + '1' * 30]
+
+
+@pytest.mark.parametrize('search_term', LONG_NUMBERS)
+def test_long_numeric_search_returns_no_error(client, api_headers, make_orders, search_term):
+    make_orders(5)
+    assert client.get('/dashboard', query_string={'search_term': search_term}).status_code == 200
+    response = client.get('/api/v1/orders', query_string={'search_term': search_term}, headers=api_headers)
+    assert response.status_code == 200
+    assert response.get_json()['data'] == []
+
+
+def test_numeric_search_still_matches_order_id_and_phone(client, api_headers, make_orders):
+    make_orders(5)
+    by_id = client.get('/api/v1/orders', query_string={'search_term': '3'}, headers=api_headers).get_json()
+    assert [order['id'] for order in by_id['data']] == [3]
+    by_phone = client.get('/api/v1/orders', query_string={'search_term': '12000004'}, headers=api_headers).get_json()
+    assert [order['customer_phone'] for order in by_phone['data']] == ['0912000004']
+
+
+@pytest.mark.parametrize('query_string', [
+    {'after': '2025-01-01_99999999999999999999999'},
+    {'before': '2025-01-01_-99999999999999999999999'},
+    {'search_term': '1234', 'after': '99999999999999999999999_1'},
+    {'search_term': '1234', 'before': '1_99999999999999999999999'},
+])
+def test_out_of_range_cursor_is_ignored(client, api_headers, make_orders, query_string):
+    make_orders(5)
+    assert client.get('/dashboard', query_string=query_string).status_code == 200
+    response = client.get('/api/v1/orders', query_string=query_string, headers=api_headers)
+    assert response.status_code == 200
+    assert response.get_json()['prev_cursor'] is None
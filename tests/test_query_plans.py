@@ -0,0 +1,60 @@
+# كل استعلام SELECT تنفذه صفحات لوحة التحكم والإحصائيات والفاتورة يجب أن يستخدم فهرساً (EXPLAIN QUERY PLAN)
+import re
+
+import pytest
+from sqlalchemy import event
+
+import app as marvella
+
+# الجداول الصغيرة التي يُسمح بمسحها بالكامل
+QUERY_PLAN_SCAN_ALLOWED = {'order_stats_rollup', 'user'}
+QUERY_PLAN_FULL_SCAN_RE = re.compile(r'^SCAN (?:TABLE )?"?(\w+)"?$')
+SAMPLE_ORDER_ID = 40
+VIEW_URLS = [
+    '/dashboard',
+    '/dashboard?show_total=1',
+    '/dashboard?order_status=جديد&show_total=1',
+    '/dashboard?payment_status=تم الدفع&show_total=1',
+    '/dashboard?order_status=جديد&payment_status=تم الدفع&show_total=1',
+    f'/dashboard?search_term={SAMPLE_ORDER_ID}&show_total=1',
+    '/dashboard?search_term=12345&show_total=1',
+    '/dashboard?search_term=فستان&show_total=1',
+    '/statistics',
+    '/statistics?date_from=2025-01-01&date_to=2025-12-31',
+    f'/invoice/preview/{SAMPLE_ORDER_ID}',
+    f'/order/edit/{SAMPLE_ORDER_ID}',
+]
+
+
+def collect_view_queries(client, url):
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT') and not executemany:
+            captured.append((statement, parameters))
+
+    event.listen(marvella.db.engine, 'before_cursor_execute', capture)
+    try:
+        response = client.get(url)
+    finally:
+        event.remove(marvella.db.engine, 'before_cursor_execute', capture)
+    assert response.status_code == 200
+    return captured
+
+
+def find_full_scans(statement, parameters):
+    with marvella.db.engine.connect() as conn:
+        plan = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).all()
+    return [row[-1] for row in plan
+            if (match := QUERY_PLAN_FULL_SCAN_RE.match(row[-1])) and match.group(1) not in QUERY_PLAN_SCAN_ALLOWED]
+
+
+@pytest.mark.parametrize('url', VIEW_URLS)
+def test_view_queries_use_indexes(app, client, make_orders, url):
+    make_orders(SAMPLE_ORDER_ID)
+    with app.app_context():
+        statements = collect_view_queries(client, url)
+        assert statements
+        full_scans = {' '.join(statement.split()): find_full_scans(statement, parameters)
+                      for statement, parameters in statements}
+        assert {statement: scans for statement, scans in full_scans.items() if scans} == {}
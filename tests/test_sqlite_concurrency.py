@@ -0,0 +1,57 @@
+import sqlite3
+import threading
+import time
+
+from sqlalchemy import text
+
+import app as marvella
+
+WRITER_HOLD_SECONDS = 1.0
+
+
+def test_connection_pragmas(app):
+    with app.app_context():
+        pragma = lambda name: marvella.db.session.execute(text(f'PRAGMA {name}')).scalar()
+        assert pragma('journal_mode') == 'wal'
+        assert pragma('synchronous') == 1
+        assert pragma('busy_timeout') == app.config['SQLITE_BUSY_TIMEOUT_MS']
+        assert pragma('cache_size') == -app.config['SQLITE_CACHE_SIZE_KB']
+        assert pragma('temp_store') == 2
+
+
+def test_dashboard_readers_proceed_while_a_write_is_open(app, make_orders):
+    make_orders(60)
+    clients = []
+    for _ in range(4):
+        client = app.test_client()
+        client.post('/login', data={'username': 'admin', 'password': 'admin_password'})
+        clients.append(client)
+    with app.app_context():
+        database_path = marvella.database_path()
+
+    # كاتب يحتفظ بقفل الكتابة كما يفعل add_order أثناء commit
+    writer = sqlite3.connect(database_path, isolation_level=None, timeout=WRITER_HOLD_SECONDS * 2)
+    writer.execute('BEGIN EXCLUSIVE')
+    writer.execute('UPDATE "order" SET order_status = order_status WHERE id = (SELECT MAX(id) FROM "order")')
+    results = []
+
+    def read_dashboard(client):
+        started = time.perf_counter()
+        status_code = client.get('/dashboard').status_code
+        results.append((status_code, time.perf_counter() - started))
+
+    threads = [threading.Thread(target=read_dashboard, args=(client,)) for client in clients]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(WRITER_HOLD_SECONDS)
+        finished_while_writing = list(results)
+    finally:
+        writer.execute('ROLLBACK')
+        writer.close()
+        for thread in threads:
+            thread.join()
+
+    assert len(finished_while_writing) == len(clients)
+    assert all(status_code == 200 and elapsed < WRITER_HOLD_SECONDS for status_code, elapsed in finished_while_writing)
@@ -0,0 +1,68 @@
+from sqlalchemy import update
+
+import app as marvella
+
+STATISTICS_URLS = ('/statistics', '/statistics?date_from=2025-01-01&date_to=2025-12-31')
+
+
+def statements_per_url(client, capture_statements):
+    counts = {}
+    for url in STATISTICS_URLS:
+        with capture_statements() as statements:
+            assert client.get(url).status_code == 200
+        counts[url] = len(statements)
+    return counts
+
+
+def test_statistics_statement_count_does_not_grow_with_data(client, make_orders, capture_statements):
+    make_orders(10)
+    small = statements_per_url(client, capture_statements)
+    make_orders(500, cities=('الخرطوم', 'أم درمان', 'بحري', 'مدني', 'بورتسودان', 'كسلا', 'عطبرة'))
+    large = statements_per_url(client, capture_statements)
+    assert small == large
+    assert all(small.values())
+
+
+def test_statistics_match_orders(app, make_orders):
+    make_orders(40)
+    with app.app_context():
+        stats = marvella.compute_order_stats('', '')
+        paid = marvella.Order.query.filter_by(payment_status='تم الدفع').all()
+    assert stats['total_orders'] == 40
+    assert stats['total_revenue'] == sum(order.total_cost for order in paid)
+    assert stats['completed_orders'] == 10
+
+
+def rollup_rows(app):
+    with app.app_context():
+        rows = marvella.db.session.query(
+            marvella.OrderStatsRollup.day, marvella.OrderStatsRollup.destination_city,
+            marvella.OrderStatsRollup.order_status, marvella.OrderStatsRollup.payment_status,
+            marvella.OrderStatsRollup.order_count, marvella.OrderStatsRollup.products_revenue,
+            marvella.OrderStatsRollup.shipping_revenue,
+        ).filter(marvella.OrderStatsRollup.order_count != 0).all()
+    return sorted(tuple(row) for row in rows)
+
+
+def test_incremental_rollup_matches_rebuild_with_undated_orders(app, client, make_orders):
+    make_orders(6)
+    with app.app_context():
+        marvella.db.session.execute(update(marvella.Order).where(
+            marvella.Order.id.in_([2, 3, 4])).values(created_at=None))
+        marvella.rebuild_stats_rollup()
+    response = client.post('/order/edit/2', data={
+        'customer_name': 'عميل', 'customer_phone': '0912000001', 'destination_city': 'بحري', 'shipping_cost': '30',
+        'order_status': 'في الطريق', 'payment_status': 'تم الدفع', 'product_name': 'فستان', 'product_quantity': '1',
+        'product_price': '20',
+    })
+    assert response.status_code == 302
+    response = client.post('/orders/bulk-status', data={
+        'order_ids': ['1', '3', '5'], 'new_order_status': 'تم التسليم', 'new_payment_status': 'تم الدفع',
+    })
+    assert response.status_code == 302
+    assert client.get('/order/delete/4').status_code == 302
+    incremental = rollup_rows(app)
+    with app.app_context():
+        marvella.rebuild_stats_rollup()
+    assert rollup_rows(app) == incremental
+    assert sum(row[4] for row in incremental) == 3
@@ -0,0 +1,19 @@
+# نقطة الدخول للإنتاج (بدلاً من app.run في وضع التطوير)
+#   gunicorn wsgi:app              (يقرأ الإعدادات من gunicorn.conf.py)
+#   python wsgi.py                 (waitress: عملية واحدة بعدة خيوط، يعمل على Windows أيضاً)
+import os
+
+from app import create_app, init_database
+
+app = create_app({'SCHEDULER_ENABLED': True, 'TEMPLATE_PRECOMPILE': True})
+init_database()
+
+if __name__ == '__main__':
+    from waitress import serve
+
+    serve(
+        app,
+        host=os.environ.get('HOST', '0.0.0.0'),
+        port=int(os.environ.get('PORT', '5000')),
+        threads=int(os.environ.get('WEB_THREADS', '8'))
+    )